@@ -0,0 +1,101 @@
+"""Benchmark of gc1.call_performance_information.
+
+Compares the former implementation, which scanned the transactions once
+per statistic and merged the results on ``ids[0]``, with the single
+grouped pass. Both are run on the same synthetic transactions and must
+give the same ``sfile`` and ``out``.
+
+    python benchmarks/bench_cpt.py [rows ...]
+"""
+import sys
+import numpy as np
+import pandas as pd
+from common import IDS, best_of, make_calls
+from gc1 import MISSING, call_performance_information, key_code
+
+
+def cpt_former(trans, labeled, ids, valid_qs):
+    """The former implementation, with sorts made stable."""
+    df = trans[ids].drop_duplicates(ids)
+    out = {}
+    out['uniques'] = len(trans[ids[0]].unique())
+    out['passes'] = trans[ids[0]].value_counts().max()
+    out['pickups'] = len(trans[trans['Contact Result'] == 'answered']
+                         [ids[0]].unique())
+    answer_ids = trans[trans['Contact Result'] == 'answered'][ids[0]]
+    df['pickup'] = np.where(df[ids[0]].isin(answer_ids), 1, 0)
+    out['verified'] = len(trans[trans.Q1 == key_code(1)])
+    out['removes'] = len(labeled['remove'].dropna())
+    inv = pd.crosstab(trans[ids[0]], trans['Contact Result'])
+    mask = ((inv['answered'] == 0) & (inv['busy'] == 0) &
+            (inv['fax'] == 0) & (inv['machine'] == 0) &
+            (inv['noAnswer'] == 0) & (inv['invalid'] >= 1))
+    out['invalids'] = len(inv[mask])
+    invalid_ids = inv[mask].index
+    df['invalid'] = np.where(df[ids[0]].isin(invalid_ids), 1, 0)
+    attempts = trans[ids[0]].value_counts()
+    attempts = pd.DataFrame({ids[0]: attempts.index,
+                             'attempts': attempts.values})
+    df = pd.merge(df, attempts, on=ids[0])
+    out['invalids'] = len(inv[mask])
+    invalid_ids = inv[mask].index
+    df['invalid'] = np.where(df[ids[0]].isin(invalid_ids), 1, 0)
+    out['cost'] = trans.Charge.sum()
+    answered = trans[valid_qs] != MISSING
+    out['completes'] = answered.sum()
+    out['cost_per'] = out['cost'] / out['completes']
+    out['mean_time'] = trans['Seconds'].mean()
+    out['sd_time'] = trans['Seconds'].std()
+    cost = trans[[ids[0], 'Charge']].groupby(ids[0]).sum()
+    cost = pd.DataFrame({ids[0]: cost.index,
+                         'cost': cost['Charge'].values})
+    df = pd.merge(df, cost, on=ids[0])
+    trans['answers'] = answered.sum(axis=1)
+    trans = trans.sort_values(['answers'], ascending=False, kind='mergesort')
+    answers = trans.drop_duplicates(ids)[ids+['answers']]
+    df = pd.merge(df, answers, on=ids)
+    labeled['answers2'] = labeled.count(axis=1)
+    labeled = labeled.sort_values('answers2', ascending=False,
+                                  kind='mergesort')
+    longest = labeled.drop_duplicates(ids)
+    del longest['answers2']
+    sfile = pd.merge(longest, df, on=ids)
+    sfile = sfile.sort_values('timestamp', kind='mergesort')
+    cols = pd.Series(ids + df.columns.tolist() + longest.columns.tolist())
+    cols = cols.drop_duplicates().tolist()
+    sfile = sfile[cols]
+    return([sfile, out])
+
+
+def check_same(expected, actual):
+    (e_sfile, e_out), (a_sfile, a_out) = expected, actual
+    assert list(e_sfile.columns) == list(a_sfile.columns)
+    for col in e_sfile.columns:
+        e, a = e_sfile[col].values, a_sfile[col].values
+        if e.dtype.kind == 'f':
+            assert np.allclose(e, a, equal_nan=True), col
+        else:
+            assert (pd.isnull(e) & pd.isnull(a) | (e == a)).all(), col
+    assert list(e_out) == list(a_out)
+    for k in e_out:
+        assert np.allclose(e_out[k], a_out[k]), k
+
+
+def run(n):
+    trans, labeled, valid_qs = make_calls(n)
+
+    def setup():
+        return(trans.copy(), labeled.copy(), IDS, valid_qs)
+
+    former, expected = best_of(cpt_former, setup)
+    grouped, actual = best_of(call_performance_information, setup)
+    former, grouped = min(former), min(grouped)
+    check_same(expected, actual)
+    print('{:>9,} rows  former: {:8.3f}s  grouped: {:8.3f}s  '
+          'speedup: {:5.1f}x'.format(n, former, grouped, former / grouped))
+
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [100000, 1000000]
+    for n in sizes:
+        run(n)
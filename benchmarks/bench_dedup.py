@@ -0,0 +1,34 @@
+"""Benchmark of removing duplicate calls from the transactional frame.
+
+Compares ``DataFrame.drop_duplicates`` over every column with
+``gc1.drop_duplicate_calls``, which drops rows by a 64-bit fingerprint,
+on a wide frame of string columns. Reports time and peak memory (as
+traced by tracemalloc) of each.
+
+    python benchmarks/bench_dedup.py [rows ...]
+"""
+import sys
+from common import make_trans, measure
+from gc1 import drop_duplicate_calls
+
+
+def run(n):
+    trans = make_trans(n)
+    columns = [c for c in trans.columns if c != 'source']
+    full, full_peak, expected = measure(
+        lambda df: df.drop_duplicates(columns), trans)
+    hashed, hashed_peak, (actual, report) = measure(
+        drop_duplicate_calls, trans)
+    assert expected.index.equals(actual.index)
+    mb = 1024.0 ** 2
+    print('{:>9,} rows  drop_duplicates: {:7.3f}s {:7.1f}MB  '
+          'fingerprint: {:7.3f}s {:7.1f}MB  ({:,} duplicates, {:,} from '
+          'other files)'.format(len(trans), full, full_peak / mb, hashed,
+                                hashed_peak / mb, report['duplicates'],
+                                report['overlapping']))
+
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [100000, 1000000]
+    for n in sizes:
+        run(n)
@@ -0,0 +1,52 @@
+"""Micro-benchmark of the "push question" step of gc1.process_version.
+
+Compares the former column-by-column ``.loc`` shift on a DataFrame with
+the single masked shift in ``matrix.push_right``.
+
+    python benchmarks/bench_push.py [rows ...]
+"""
+import sys
+import pandas as pd
+from common import QUESTIONS, best_of, make_responses
+from matrix import MISSING, push_right
+
+
+def push_loc(v_data, push_ix, j):
+    """The former implementation: one .loc assignment per column."""
+    k = len(v_data.columns) - 1
+    while k > (j-1):
+        k_col = v_data.columns.values[k]
+        k_minus1 = v_data.columns.values[(k-1)]
+        v_data.loc[push_ix, k_col] = v_data.loc[push_ix, k_minus1]
+        k = k - 1
+    v_data.loc[push_ix, v_data.columns.values[(j-1)]] = MISSING
+
+
+def run(n, j=2):
+    values, mask = make_responses(n)
+    columns = ['Q' + str(i) for i in range(1, QUESTIONS + 1)]
+
+    def setup_loc():
+        v_data = pd.DataFrame(values.copy(), columns=columns)
+        return(v_data, v_data.index[mask], j)
+
+    def setup_array():
+        return(values.copy(), mask, j - 1)
+
+    # Both approaches must agree before timing them
+    v_data, push_ix, _ = setup_loc()
+    push_loc(v_data, push_ix, j)
+    expected, _, col = setup_array()
+    push_right(expected, mask, col)
+    assert (v_data.values == expected).all()
+
+    loc = min(best_of(push_loc, setup_loc)[0])
+    array = min(best_of(push_right, setup_array)[0])
+    print('{:>9,} rows  loc: {:8.4f}s  push_right: {:8.4f}s  '
+          'speedup: {:6.1f}x'.format(n, loc, array, loc / array))
+
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [100000, 1000000]
+    for n in sizes:
+        run(n)
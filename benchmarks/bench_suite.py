@@ -0,0 +1,164 @@
+"""Benchmark suite of the main processing stages on synthetic returns.
+
+Times ``load_returns``, ``process_version`` (of the first version),
+``macro`` and ``call_performance_information`` on returns written by
+``synthetic.write_returns`` at each size, and writes the results as JSON
+along with the commit and library versions they were measured with.
+Pass an earlier results file to ``--compare`` to see the change per
+stage.
+
+    python benchmarks/bench_suite.py [-c config.yaml] [--rows N ...]
+        [--repeat N] [--data DIR] [-o results.json] [--compare old.json]
+"""
+import os
+import json
+import shutil
+import argparse
+import platform
+import datetime
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+from common import best_of
+import gc1
+import synthetic
+
+SIZES = [10000, 100000, 1000000, 10000000]
+STAGES = ['load_returns', 'process_version', 'macro',
+          'call_performance_information']
+# Slowdown reported as a regression by --compare
+THRESHOLD = 0.1
+
+
+def commit():
+    """The checked out commit, or None outside a git work tree."""
+    try:
+        out = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.CalledProcessError):
+        return(None)
+    return(out.decode().strip())
+
+
+def returns_dir(root, n, config, seed):
+    """Synthetic returns of `n` calls under `root`, written if not there.
+    """
+    name = os.path.splitext(os.path.basename(config or 'example'))[0]
+    path = os.path.join(root, '{}-{}-{}'.format(name, n, seed))
+    if not os.path.isdir(path):
+        synthetic.write_returns(path + '.tmp', n, config, seed=seed)
+        os.rename(path + '.tmp', path)
+    return(path)
+
+
+def run(path, plan, repeat, workers):
+    """Time each of `STAGES` on the returns in `path`."""
+    data = gc1.load_returns(path, workers)
+    prepared = data.copy()
+    ids, resp_data, labels, versions = gc1.prepare_returns(prepared, plan)
+    version = versions[0]
+    rows = (labels['version'] == version).values
+    qs = resp_data.names
+    raw, labeled = gc1.process_versions(resp_data, labels, versions, plan)
+    trans = gc1.transactions(prepared, raw, plan.valid_qs)
+    trans = gc1.drop_duplicate_calls(trans)[0]
+    stages = {
+        'load_returns': (lambda: gc1.load_returns(path, workers),
+                         lambda: ()),
+        'process_version': (
+            lambda m, lab: gc1.process_version(
+                m, plan.for_version(version), lab, False, qs),
+            lambda: (resp_data.take(rows), labels[rows].copy())),
+        'macro': (lambda d: gc1.macro(d, plan, workers=workers),
+                  lambda: (data.copy(),)),
+        'call_performance_information': (
+            lambda: gc1.call_performance_information(
+                trans, labeled, ids, plan.valid_qs),
+            lambda: ()),
+    }
+    results = []
+    for stage in STAGES:
+        func, setup = stages[stage]
+        times, _ = best_of(func, setup, repeat)
+        results.append({'stage': stage, 'calls': len(data),
+                        'seconds': min(times), 'times': times,
+                        'calls_per_second': len(data) / min(times)})
+    return(results)
+
+
+def compare(old, new, threshold=THRESHOLD):
+    """Print the change in best time of each stage and size in both runs.
+    """
+    before = dict(((r['stage'], r['rows']), r['seconds'])
+                  for r in old['results'])
+    print('compared with {}'.format(old.get('commit')))
+    for r in new['results']:
+        key = (r['stage'], r['rows'])
+        if key not in before:
+            continue
+        ratio = r['seconds'] / before[key]
+        print('{:<30} {:>10,}  {:8.3f}s -> {:8.3f}s  {:5.2f}x{}'.format(
+            r['stage'], r['rows'], before[key], r['seconds'], ratio,
+            '  slower' if ratio > 1 + threshold else ''))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark gc1 stages on synthetic returns')
+    parser.add_argument('-c', action='store', dest='config',
+                        help='config file (default: '
+                        'surveyor/templates/example.yaml)',
+                        default=None)
+    parser.add_argument('--rows', action='store', type=int, nargs='+',
+                        dest='rows', help='numbers of calls to run with',
+                        default=SIZES)
+    parser.add_argument('--repeat', action='store', type=int, dest='repeat',
+                        help='runs of each stage; the best is kept',
+                        default=3)
+    parser.add_argument('-j', action='store', type=int, dest='workers',
+                        help='worker processes for loading and macro',
+                        default=1)
+    parser.add_argument('--seed', action='store', type=int, dest='seed',
+                        help='random seed of the returns', default=0)
+    parser.add_argument('--data', action='store', dest='data',
+                        help='keep the synthetic returns in (and reuse '
+                             'them from) this directory', default=None)
+    parser.add_argument('-o', action='store', dest='output',
+                        help='results file', default='bench_suite.json')
+    parser.add_argument('--compare', action='store', dest='compare',
+                        help='earlier results file to compare with',
+                        default=None)
+    args = parser.parse_args()
+    plan = synthetic.load_plan(args.config)
+    root = args.data or tempfile.mkdtemp(prefix='gc1-bench-')
+    report = {
+        'commit': commit(),
+        'created': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'config': args.config,
+        'repeat': args.repeat,
+        'workers': args.workers,
+        'seed': args.seed,
+        'results': [],
+    }
+    try:
+        for n in args.rows:
+            path = returns_dir(root, n, args.config, args.seed)
+            for r in run(path, plan, args.repeat, args.workers):
+                r['rows'] = n
+                report['results'].append(r)
+                print('{:<30} {:>10,} rows  {:8.3f}s'.format(
+                    r['stage'], n, r['seconds']))
+    finally:
+        if not args.data:
+            shutil.rmtree(root, ignore_errors=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
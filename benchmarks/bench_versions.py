@@ -0,0 +1,62 @@
+"""Benchmark of splitting returns by version and assembling the results.
+
+Compares the former approach of gc1.macro (a boolean-mask copy of the
+responses and labels per version, a concat of the results, then dropping
+the responses from the data and merging the processed ones back on the
+index) with ``process_versions`` and ``transactions``, which group rows
+once, process slices of one array in place and assemble once. Reports
+time and peak memory (as traced by tracemalloc) of each.
+
+    python benchmarks/bench_versions.py [rows ...]
+"""
+import sys
+import pandas as pd
+from common import make_returns, measure
+import gc1
+import synthetic
+
+
+def former(data, resp_data, labels, versions, plan):
+    """Mask copies per version, a concat, a drop and a merge."""
+    qs = resp_data.names
+    resp = resp_data.to_frame()
+    results = []
+    for v in versions:
+        v_data = resp[(data.version == v).values]
+        l_data = labels[labels.version == v]
+        v_data, l_data = gc1.process_version(v_data, plan.for_version(v),
+                                             l_data, False, qs)
+        results.append((v_data.to_frame(), l_data))
+    raw = pd.concat([r for r, _ in results])
+    labeled = pd.concat([l for _, l in results])
+    trans = pd.merge(data.drop(qs, axis=1), raw[plan.valid_qs],
+                     left_index=True, right_index=True)
+    return(trans, labeled)
+
+
+def grouped(data, resp_data, labels, versions, plan):
+    """Grouped once, processed in place, assembled once."""
+    raw, labeled = gc1.process_versions(resp_data, labels, versions, plan)
+    return(gc1.transactions(data, raw, plan.valid_qs), labeled)
+
+
+def run(n):
+    plan = synthetic.load_plan()
+    data = make_returns(n)
+    args = (data,) + tuple(gc1.prepare_returns(data, plan)[1:]) + (plan,)
+    size = data.memory_usage(index=False).sum()
+    f_time, f_peak, (f_trans, f_labeled) = measure(former, *args)
+    g_time, g_peak, (g_trans, g_labeled) = measure(grouped, *args)
+    # Both must give the same rows; only the row order differs
+    assert f_trans.sort_index().equals(g_trans.sort_index())
+    assert f_labeled.sort_index().equals(g_labeled.sort_index())
+    mb = 1024.0 ** 2
+    print('{:>9,} rows ({:6.1f}MB)  former: {:6.3f}s {:7.1f}MB  '
+          'grouped: {:6.3f}s {:7.1f}MB'.format(
+              n, size / mb, f_time, f_peak / mb, g_time, g_peak / mb))
+
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [100000, 1000000]
+    for n in sizes:
+        run(n)
@@ -0,0 +1,121 @@
+"""Timing helpers and synthetic frames shared by the benchmarks.
+
+The frames here are built in memory, already typed the way the stage
+being timed receives them; `synthetic` writes whole return files.
+"""
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'surveyor'))
+import gc1
+from synthetic import QUESTIONS, RESULTS, RESULT_P
+
+IDS = ['id1', 'id2']
+VERSIONS = ['A', 'B', 'C', 'D']
+
+
+def best_of(func, setup, repeat=3):
+    """Times of `repeat` calls of ``func(*setup())``, and the last result.
+
+    Setup is not timed.
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return(times, result)
+
+
+def measure(func, *args):
+    """Time of one call to `func`, then its peak memory in another (tracing
+    slows pandas down too much to time the same call)."""
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return(elapsed, peak, result)
+
+
+def make_responses(n, seed=0):
+    """Random response codes, shape ``(n, QUESTIONS)``, and a mask of
+    about 30% of the rows."""
+    rng = np.random.RandomState(seed)
+    values = rng.randint(gc1.MISSING, 12,
+                         size=(n, QUESTIONS)).astype(np.int8)
+    mask = rng.rand(n) < 0.3
+    return(values, mask)
+
+
+def make_returns(n, seed=0):
+    """Combined returns for `n` calls to about n / 3 respondents, as
+    gc1.combine_returns gives them."""
+    rng = np.random.RandomState(seed)
+    acct = rng.randint(0, max(n // 3, 1), n)
+    result = rng.choice(RESULTS, n, p=RESULT_P)
+    data = pd.DataFrame({
+        'Account Number 1': acct.astype(str).astype(object),
+        'Account Number 2': (acct % 7).astype(str).astype(object),
+        'Charge': np.round(rng.rand(n) * .1, 3),
+        'Contact Result': pd.Categorical(result),
+        'First Name': 'F',
+        'Last Name': 'L',
+        'Phone #': (5550000 + acct).astype(str).astype(object),
+        'Seconds': rng.randint(1, 120, n).astype(float),
+        'Time': '10:00:00 AM',
+    })
+    lengths = np.where(result == 'answered', rng.randint(0, 9, n), 0)
+    for i in range(QUESTIONS):
+        codes = rng.randint(0, 12, n).astype(np.int8)
+        codes[lengths <= i] = gc1.MISSING
+        data['Q' + str(i + 1)] = codes
+    data['version'] = pd.Categorical.from_codes(
+        rng.randint(0, len(VERSIONS), n), VERSIONS)
+    data['timestamp'] = pd.Timestamp('2015-10-10') + pd.to_timedelta(
+        rng.randint(0, 4 * 86400, n), unit='s')
+    return(data)
+
+
+def make_calls(n, seed=0):
+    """Transactions and labels for `n` calls, as given to
+    gc1.call_performance_information."""
+    data = make_returns(n, seed)
+    valid_qs = ['Q' + str(i) for i in range(1, QUESTIONS + 1)]
+    trans = data.rename(columns={'Account Number 1': 'id1',
+                                 'Account Number 2': 'id2'})
+    trans = trans[IDS + ['Charge', 'Contact Result', 'Seconds'] +
+                  valid_qs + ['timestamp']]
+    labeled = trans[IDS + ['timestamp']].copy()
+    for q in valid_qs[:8]:
+        labels = np.array(['a', 'b', 'c', None], dtype=object)
+        labeled['name_' + q] = labels[np.minimum(trans[q].values, 3)]
+    labeled['remove'] = np.where(trans['Q8'].values == 9, 'yes', None)
+    return(trans, labeled, valid_qs)
+
+
+def make_trans(n, seed=0, duplicated=0.05, string_columns=12):
+    """A wide transactional frame of `n` calls from ten return files,
+    with `duplicated` of them repeated."""
+    rng = np.random.RandomState(seed)
+    acct = rng.randint(0, n, n)
+    trans = pd.DataFrame({'Account Number 1': acct.astype(str)})
+    for i in range(string_columns):
+        values = rng.randint(0, 1000, n).astype(str).astype(object)
+        trans['Text {}'.format(i)] = 'value-' + values
+    trans['Charge'] = np.round(rng.rand(n) * .1, 3)
+    for i in range(1, QUESTIONS + 1):
+        trans['Q' + str(i)] = rng.randint(-1, 12, n).astype(np.int8)
+    trans['source'] = pd.Categorical.from_codes(
+        np.arange(n) * 10 // n, ['file{}.txt'.format(i) for i in range(10)])
+    # Repeat some rows, as overlapping return files do
+    repeats = trans.sample(frac=duplicated, random_state=seed)
+    repeats['source'] = 'file0.txt'
+    return(pd.concat([trans, repeats], ignore_index=True))
@@ -0,0 +1,180 @@
+"""Synthetic GC1 return files for benchmarks.
+
+Writes tab separated ``Campaign version-<V> Day<i>_MM_DD_YYYY.txt`` files
+with calls to a pool of respondents. Answered calls walk through the
+questions of a config the way the processing engine reads them back:
+`onlyif` branches are followed (skipped questions get no keypress), some
+answers are preceded by invalid keypresses and some respondents hang up
+part way. A share of the rows are repeated, within a file and from the
+previous file of the same version, as happens with overlapping exports.
+
+    python benchmarks/synthetic.py [-c config.yaml] [--rows N]
+        [--files N] [--seed N] output_dir
+"""
+import os
+import sys
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'surveyor'))
+import gc1
+
+# Config used when none is given
+EXAMPLE_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              '..', 'surveyor', 'templates', 'example.yaml')
+# Versions written for configs without versioned questions
+VERSIONS = ['A', 'B']
+RESULTS = ['answered', 'busy', 'fax', 'machine', 'noAnswer', 'invalid']
+RESULT_P = [.5, .1, .05, .15, .1, .1]
+QUESTIONS = 20
+# Most rows in one return file
+FILE_ROWS = 250000
+FIRST_DAY = datetime.date(2015, 10, 10)
+
+
+def load_plan(config=None):
+    """A `gc1.ConfigPlan` from a config file, a config dict or
+    `EXAMPLE_CONFIG`."""
+    if config is None:
+        config = EXAMPLE_CONFIG
+    if isinstance(config, str):
+        config = gc1.load_config(config)
+    else:
+        config = gc1.ValidConfig().to_python(config)
+    return(gc1.compile_config(config))
+
+
+def versions_of(plan):
+    return(sorted(set(q.version for q in plan.questions if q.version))
+           or VERSIONS)
+
+
+def keypresses(plan, version, answered, rng, invalid=0.05, hangup=0.1):
+    """The raw keypress codes of each call, shape ``(calls, QUESTIONS)``.
+
+    Only `answered` calls press keys. Before each question a call hangs
+    up with probability `hangup`; an answer is preceded by an invalid key
+    with probability `invalid`.
+    """
+    n = len(answered)
+    keys = np.full((n, QUESTIONS), gc1.MISSING, dtype=np.int8)
+    # Final answer to each question order, as processing will see it
+    answers = np.full((n, QUESTIONS + 1), gc1.MISSING, dtype=np.int8)
+    pos = np.zeros(n, dtype=np.intp)
+    alive = answered.copy()
+    rows = np.arange(n)
+    questions = plan.for_version(version)
+    for order in range(1, max(plan.orders) + 1):
+        alive &= (pos < QUESTIONS) & (rng.rand(n) >= hangup)
+        if order not in plan.orders:
+            # Nothing reads this column, but a key is still pressed
+            keys[alive, pos[alive]] = rng.randint(0, 10, alive.sum())
+            pos[alive] += 1
+            continue
+        asked = np.zeros(n, dtype=bool)
+        for q in [q for q in questions if q.order == order]:
+            if q.onlyif:
+                ix = q.onlyif_valid[answers[:, int(q.onlyif[1:])]]
+            else:
+                ix = np.ones(n, dtype=bool)
+            ix &= alive & ~asked
+            asked |= ix
+            bad = np.flatnonzero(~q.valid[:len(gc1.PHONE_KEYS)])
+            if len(bad):
+                miss = ix & (rng.rand(n) < invalid) & (pos < QUESTIONS - 1)
+                keys[miss, pos[miss]] = rng.choice(bad, miss.sum())
+                pos[miss] += 1
+            codes = rng.choice(q.codes, ix.sum())
+            keys[rows[ix], pos[ix]] = codes
+            answers[ix, order] = codes
+            pos[ix] += 1
+    return(keys)
+
+
+def make_return(plan, version, day, n, rng, respondents, duplicated=0.02):
+    """One day's return file for `version`, as a frame of strings."""
+    acct = rng.randint(0, respondents, n)
+    result = rng.choice(RESULTS, n, p=RESULT_P)
+    seconds = rng.randint(1, 120, n)
+    df = pd.DataFrame({
+        'Account Number 1': acct.astype(str),
+        'Account Number 2': (acct % 7).astype(str),
+        'Charge': np.round(rng.rand(n) * .1, 3).astype(str),
+        'Contact Result': result,
+        'First Name': 'F',
+        'Last Name': 'L',
+        'Other 1': '',
+        'Other 2': '',
+        'Phone #': (5550000000 + acct).astype(str),
+    })
+    keys = keypresses(plan, version, result == 'answered', rng)
+    for i in range(QUESTIONS):
+        df['Q' + str(i + 1)] = gc1.decode_responses(keys[:, i])
+    df['Seconds'] = seconds.astype(str)
+    clock = rng.randint(0, 12 * 3600, n)
+    df['Time'] = pd.to_datetime(clock, unit='s').strftime('%I:%M:%S %p')
+    if duplicated:
+        repeats = df.sample(frac=duplicated, random_state=rng)
+        df = pd.concat([df, repeats], ignore_index=True)
+    name = 'Campaign version-{} Day{}_{}.txt'.format(
+        version, day, (FIRST_DAY + datetime.timedelta(days=day)).strftime(
+            '%m_%d_%Y'))
+    return(name, df)
+
+
+def write_returns(path, rows, config=None, files=None, seed=0,
+                  duplicated=0.02):
+    """Write about `rows` calls of synthetic returns to `path`.
+
+    `config` is a config file, a config dict or None for
+    `EXAMPLE_CONFIG`. Calls are split over `files` return files (by
+    default enough to keep each under `FILE_ROWS`, and at least one per
+    version); each file holds one version and day. Files repeat
+    `duplicated` of their rows, half of them taken from the previous
+    file of the same version. Returns the paths written.
+    """
+    plan = load_plan(config)
+    versions = versions_of(plan)
+    if files is None:
+        files = max(len(versions), -(-rows // FILE_ROWS))
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    respondents = max(rows // 3, 1)
+    written = []
+    previous = {}
+    for day in range(files):
+        n = rows // files + (day < rows % files)
+        version = versions[day % len(versions)]
+        name, df = make_return(plan, version, day, n, rng, respondents,
+                               duplicated / 2)
+        if version in previous and duplicated:
+            overlap = previous[version].sample(frac=duplicated / 2,
+                                               random_state=rng)
+            df = pd.concat([df, overlap], ignore_index=True)
+        df.to_csv(os.path.join(path, name), sep='\t', index=False)
+        written.append(os.path.join(path, name))
+        previous[version] = df
+    return(written)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Write synthetic GC1 return files')
+    parser.add_argument('-c', action='store', dest='config',
+                        help='config file to answer (default: '
+                        'surveyor/templates/example.yaml)',
+                        default=None)
+    parser.add_argument('--rows', action='store', type=int, dest='rows',
+                        help='number of calls', default=100000)
+    parser.add_argument('--files', action='store', type=int, dest='files',
+                        help='number of return files', default=None)
+    parser.add_argument('--seed', action='store', type=int, dest='seed',
+                        help='random seed', default=0)
+    parser.add_argument('output_dir', action='store',
+                        help='directory to write the returns to')
+    args = parser.parse_args()
+    for f in write_returns(args.output_dir, args.rows, args.config,
+                           args.files, args.seed):
+        print(f)
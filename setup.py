@@ -3,8 +3,8 @@ from setuptools import setup, find_packages
 
 install_requires = [
     'PySide>=1.0.7',
-    'numpy>=1.9.0',
-    'pandas>=0.15.0',
+    'numpy>=1.15.4',
+    'pandas>=1.1.0',
     'formencode',
     'yaml']
 
@@ -21,12 +21,16 @@ setup(
         'Operating System :: Unix',
         'Operating System :: MacOS',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4'
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9'
     ],
+    python_requires='>=3.7',
     packages=find_packages(exclude=['contrib', 'docs', 'tests*']),
     install_requires=install_requires,
     extras_require={
         'dev': ['check-manifest'],
         'test': ['coverage', 'pytest'],
+        'dataset': ['pyarrow'],
     }
 )
@@ -0,0 +1,137 @@
+"""Run many campaign configs, each in its own process.
+
+    python surveyor/batch.py -j 4 --max-memory 4096 --summary night.json \
+        campaigns/*.yaml
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+import traceback
+import multiprocessing
+from multiprocessing.connection import wait
+import gc1
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+log = logging.getLogger('gc1')
+
+
+def run_campaign(conn, config_file, options):
+    """Run one config in a worker process and send back its summary;
+    any error is reported as a failed campaign."""
+    gc1.log_to_stdout(logging.DEBUG if options['verbose'] else
+                      logging.INFO)
+    # `max_memory` is in MB and caps the whole address space, so running
+    # out of it fails this campaign with a MemoryError
+    if options['max_memory'] and resource is not None:
+        limit = options['max_memory'] * 1024 ** 2
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    summary = {'config': config_file, 'status': 'ok', 'error': None,
+               'rows': None, 'outputs': []}
+    start = time.time()
+    try:
+        summary.update(gc1.run(config_file, options['verbose'], workers=1,
+                               use_cache=options['use_cache']))
+    except Exception as e:
+        summary['status'] = 'failed'
+        summary['error'] = '{}: {}'.format(type(e).__name__, e)
+        log.debug('%s', traceback.format_exc())
+    summary['seconds'] = time.time() - start
+    conn.send(summary)
+    conn.close()
+
+
+def run_batch(config_files, jobs=1, max_memory=None, verbose=False,
+              use_cache=True):
+    """Run each of `config_files` with `gc1.run` in its own process, `jobs`
+    at a time; returns one summary per config, in order."""
+    if max_memory and resource is None:
+        log.warning('Memory limits are not supported here; ignoring '
+                    '--max-memory')
+    options = {'verbose': verbose, 'use_cache': use_cache,
+               'max_memory': max_memory}
+    pending = list(enumerate(config_files))
+    running = {}
+    summaries = [None] * len(config_files)
+    while pending or running:
+        while pending and len(running) < jobs:
+            i, config_file = pending.pop(0)
+            log.info('Starting %s', config_file)
+            # A fresh process per campaign, so one that fails or is killed
+            # leaves the others running
+            recv, send = multiprocessing.Pipe(duplex=False)
+            proc = multiprocessing.Process(
+                target=run_campaign, args=(send, config_file, options))
+            proc.start()
+            send.close()
+            running[proc.sentinel] = (i, config_file, proc, recv,
+                                      time.time())
+        for sentinel in wait(list(running)):
+            i, config_file, proc, recv, start = running.pop(sentinel)
+            summary = None
+            try:
+                if recv.poll():
+                    summary = recv.recv()
+            except EOFError:
+                pass
+            proc.join()
+            if summary is None:
+                # The process died without reporting back
+                summary = {'config': config_file, 'status': 'failed',
+                           'error': 'worker exited with code {}'.format(
+                               proc.exitcode),
+                           'rows': None, 'outputs': [],
+                           'seconds': time.time() - start}
+            log.info('Finished %s: %s in %.1fs', config_file,
+                     summary['error'] or summary['status'],
+                     summary['seconds'])
+            summaries[i] = summary
+    return(summaries)
+
+
+def format_summary(summaries):
+    lines = ['{:<8} {:>9} {:>10}  {}'.format('status', 'seconds', 'rows',
+                                              'config')]
+    for s in summaries:
+        lines.append('{:<8} {:>9.1f} {:>10}  {}'.format(
+            s['status'], s['seconds'],
+            '-' if s['rows'] is None else s['rows'], s['config']))
+    return('\n'.join(lines))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Process the gc1 returns of many campaign configs')
+    parser.add_argument('-v', action='store_true', dest='verbose',
+                        help='print verbose output to stdout', default=False)
+    parser.add_argument('-j', action='store', type=int, dest='jobs',
+                        help='number of campaigns to run at once',
+                        default=1)
+    parser.add_argument('--max-memory', action='store', type=int,
+                        dest='max_memory', metavar='MB',
+                        help='memory limit of each campaign process',
+                        default=None)
+    parser.add_argument('--no-cache', action='store_false', dest='cache',
+                        help='always parse return files from text',
+                        default=True)
+    parser.add_argument('--summary', action='store', dest='summary',
+                        metavar='PATH',
+                        help='write the per campaign summary as JSON',
+                        default=None)
+    parser.add_argument('config_files', action='store', nargs='+',
+                        help='paths to config files')
+    args = parser.parse_args()
+    gc1.log_to_stdout(logging.DEBUG if args.verbose else logging.INFO)
+    summaries = run_batch(args.config_files, args.jobs, args.max_memory,
+                          args.verbose, args.cache)
+    print(format_summary(summaries))
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summaries, f, indent=2)
+    failed = [s for s in summaries if s['status'] != 'ok']
+    sys.exit(1 if failed else 0)
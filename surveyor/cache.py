@@ -0,0 +1,118 @@
+import os
+import hashlib
+import pandas as pd
+from dupfinder import hashfile
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.surveyor',
+                                 'cache')
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+
+def fingerprint(path):
+    """Identify a file by its path, size, mtime and content hash."""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = '|'.join([path, str(st.st_size), str(st.st_mtime_ns),
+                    hashfile(path)])
+    return(hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+class ReturnsCache(object):
+    """Parsed return files pickled on disk by `fingerprint` and parser
+    `version`, evicted least recently used first past `max_bytes`."""
+    suffix = '.pkl'
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES,
+                 version=''):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.version = version
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, path):
+        if self.version:
+            return(fingerprint(path) + '-' + self.version)
+        return(fingerprint(path))
+
+    def entry(self, key):
+        return(os.path.join(self.path, key + self.suffix))
+
+    def get(self, path):
+        return(self._read(self.entry(self.key(path))))
+
+    def put(self, path, df):
+        self._write(self.entry(self.key(path)), df)
+
+    def load(self, path, parser):
+        """Return the parsed frame for `path`, calling `parser` on a miss."""
+        entry = self.entry(self.key(path))
+        df = self._read(entry)
+        if df is None:
+            df = parser(path)
+            self._write(entry, df)
+        return(df)
+
+    def _read(self, entry):
+        try:
+            df = pd.read_pickle(entry)
+        except FileNotFoundError:
+            return(None)
+        except Exception:
+            # A truncated or corrupt entry is a miss; drop it
+            self._remove(entry)
+            return(None)
+        # Mark as recently used; another process may have evicted it since
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+        return(df)
+
+    def _remove(self, entry):
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+
+    def _write(self, entry, df):
+        # Write then rename so readers never see a partial entry
+        tmp = '{}.{}.tmp'.format(entry, os.getpid())
+        df.to_pickle(tmp)
+        os.replace(tmp, entry)
+
+    def size(self):
+        return(sum(size for _, _, size in self.entries()))
+
+    def entries(self):
+        """List `(entry, mtime, size)`, skipping entries removed meanwhile."""
+        found = []
+        for f in os.listdir(self.path):
+            if f.endswith(self.suffix):
+                entry = os.path.join(self.path, f)
+                try:
+                    st = os.stat(entry)
+                except FileNotFoundError:
+                    continue
+                found.append((entry, st.st_mtime, st.st_size))
+        return(found)
+
+    def evict(self):
+        """Remove least recently used entries until under `max_bytes`."""
+        entries = sorted(self.entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        removed = 0
+        for entry, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                # Already evicted by another process
+                continue
+            total -= size
+            removed += 1
+        return(removed)
+
+    def clear(self):
+        for entry, _, _ in self.entries():
+            self._remove(entry)
@@ -0,0 +1,180 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+import gc1
+import instrument
+from cache import fingerprint
+from matrix import MISSING, ResponseMatrix
+
+log = logging.getLogger('gc1')
+
+
+def digest(obj):
+    dump = json.dumps(obj, sort_keys=True, default=str)
+    return(hashlib.sha1(dump.encode('utf-8')).hexdigest())
+
+
+def config_key(plan):
+    """Hash of the question config, labels included."""
+    return(digest(plan.config['questions']))
+
+
+def structure_key(plan):
+    """Hash of the parts of a config that decide processed responses."""
+    structure = plan.structure()
+    if structure is None:
+        return(config_key(plan))
+    return(digest(structure))
+
+
+class Checkpoint(object):
+    """Processed responses and labels of each return file, with the config
+    they were made with."""
+    manifest = 'manifest.json'
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def entry(self, key):
+        return(os.path.join(self.path, key + '.pkl'))
+
+    def load(self, structure):
+        """Fingerprints of the files processed with `structure`."""
+        try:
+            with open(os.path.join(self.path, self.manifest)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return(set())
+        if manifest.get('structure') != structure:
+            return(set())
+        return(set(manifest.get('files', [])))
+
+    def read(self, key):
+        entry = self.entry(key)
+        try:
+            return(pd.read_pickle(entry))
+        except FileNotFoundError:
+            return(None)
+        except Exception as e:
+            # A truncated, corrupt or incompatible entry is reprocessed
+            log.warning('Ignoring unreadable checkpoint entry %s: %s',
+                        entry, e)
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+            return(None)
+
+    def write(self, key, structure, config, qs, values, labels):
+        state = {'structure': structure, 'config': config, 'qs': qs,
+                 'values': values, 'labels': labels}
+        tmp = self.entry(key) + '.tmp'
+        pd.to_pickle(state, tmp)
+        os.replace(tmp, self.entry(key))
+
+    def save(self, structure, config, keys):
+        """Record `keys` as the current files and drop any other entries."""
+        tmp = os.path.join(self.path, self.manifest + '.tmp')
+        manifest = {'structure': structure, 'config': config,
+                    'files': sorted(keys)}
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(self.path, self.manifest))
+        for f in os.listdir(self.path):
+            if f.endswith('.pkl') and f[:-len('.pkl')] not in keys:
+                os.remove(os.path.join(self.path, f))
+
+
+def fill_labels(labeled, names, rows, source):
+    """Copy the `names` columns of `source` into `labeled` at `rows`."""
+    for name in names:
+        if name in source:
+            labeled.iloc[rows, names.index(name)] = source[name].values
+
+
+@instrument.stage('checkpoint')
+def process(files, config, path, verbose=False, workers=1, cache=None,
+            progress=None):
+    """Process return `files` like `gc1.macro`, only processing the rows of
+    files that are new or changed since the last run with `path`."""
+    if progress:
+        progress = gc1.ProgressThrottle(progress)
+    with gc1.verbose_logging(verbose):
+        plan = gc1.compile_config(config)
+        structure, key = structure_key(plan), config_key(plan)
+        checkpoint = Checkpoint(path)
+        stored = checkpoint.load(structure)
+        keys = [fingerprint(p) for p, _, _ in files]
+        frames = gc1.read_returns(files, workers, cache)
+        starts = np.cumsum([0] + [len(f) for f in frames])
+        data = gc1.combine_returns(frames)
+        del frames
+        ids, resp_data, labels, versions = gc1.prepare_returns(data, plan)
+        qs = resp_data.names
+        names = []
+        for v in versions:
+            names.extend(n for n in plan.label_names(v) if n not in names)
+        # Reuse whatever the checkpoint holds for unchanged files
+        values = np.full_like(resp_data.values, MISSING)
+        labeled = pd.DataFrame(dict((n, gc1.missing_labels(len(data)))
+                                    for n in names),
+                               index=data.index, columns=names)
+        new = np.zeros(len(data), dtype=bool)
+        relabel = np.zeros(len(data), dtype=bool)
+        reused = 0
+        for i, k in enumerate(keys):
+            start, end = starts[i], starts[i + 1]
+            state = checkpoint.read(k) if k in stored else None
+            # Entries of another structure, such as those of a run that
+            # never saved its manifest, are processed again
+            if (state is None or state.get('structure') != structure or
+                    state['qs'] != qs or
+                    len(state['values']) != end - start):
+                new[start:end] = True
+                continue
+            values[start:end] = state['values']
+            reused += 1
+            # Only names or labels changed: keep the responses, relabel them
+            if state.get('config') != key:
+                relabel[start:end] = True
+                continue
+            fill_labels(labeled, names, slice(start, end), state['labels'])
+        log.info('Reusing %d of %d return files from checkpoint', reused,
+                 len(keys))
+        instrument.note(rows=len(data), files=len(keys), reused=reused)
+        # Relabel reused rows when only labeling changed
+        if relabel.any():
+            log.info('Config labels changed, relabeling stored responses')
+            rows = np.flatnonzero(relabel)
+            labeled_old = gc1.relabel_versions(
+                ResponseMatrix(values[rows], data.index[rows], qs),
+                labels.iloc[rows], versions, plan)
+            fill_labels(labeled, names,
+                        data.index.get_indexer(labeled_old.index),
+                        labeled_old)
+        # Process rows from new files and merge them in
+        if new.any():
+            raw_new, labeled_new = gc1.process_versions(
+                resp_data.take(new), labels[new], versions, plan, verbose,
+                workers, progress)
+            rows = data.index.get_indexer(raw_new.index)
+            values[rows] = raw_new.values
+            fill_labels(labeled, names,
+                        data.index.get_indexer(labeled_new.index),
+                        labeled_new)
+        for i, k in enumerate(keys):
+            start, end = starts[i], starts[i + 1]
+            if new[start:end].any() or relabel[start:end].any():
+                checkpoint.write(
+                    k, structure, key, qs, values[start:end],
+                    labeled.iloc[start:end].reset_index(drop=True))
+        checkpoint.save(structure, key, set(keys))
+        # Same row order as a full run: grouped by version
+        order, _ = gc1.version_groups(labels, versions)
+        raw = ResponseMatrix(values, data.index, qs).take(order)
+        labeled = pd.concat([labels, labeled], axis=1).iloc[order]
+        return(gc1.finish_returns(data, raw, labeled, ids, plan, progress))
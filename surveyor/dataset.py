@@ -0,0 +1,191 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from matrix import MISSING, response_columns
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+FORMATS = {'parquet': '.parquet', 'feather': '.feather'}
+# Tables are partitioned into <table>/version=<v>/date=<d>/ directories
+PARTITIONS = ('version', 'date')
+# Directory name for rows without a version or date
+MISSING_PARTITION = '__missing__'
+METADATA = '_metadata.json'
+
+
+def check_format(fmt):
+    """Raise if datasets of format `fmt` cannot be written here."""
+    if fmt not in FORMATS:
+        raise ValueError('Unknown dataset format: {}'.format(fmt))
+    if pyarrow is None:
+        raise ImportError('Writing a {} dataset needs pyarrow'.format(fmt))
+
+
+def partition_values(df):
+    """The version and date partition of each row of `df`, as strings."""
+    values = {}
+    for col in PARTITIONS:
+        if col in df:
+            series = df[col].astype(object)
+        elif col == 'date' and 'timestamp' in df:
+            # Frames without a date are partitioned by their timestamp
+            series = df['timestamp'].dt.strftime('%Y-%m-%d').astype(object)
+        else:
+            series = pd.Series(np.nan, index=df.index, dtype=object)
+        values[col] = series.where(series.notnull(), MISSING_PARTITION)
+        values[col] = values[col].astype(str).values
+    return(values)
+
+
+def write_table(df, path, fmt):
+    """Write `df` as one file per (version, date) partition under `path`;
+    returns the table's metadata."""
+    os.makedirs(path)
+    # Partition values are kept in the directory names, not the files
+    data = df.drop([c for c in PARTITIONS if c in df], axis=1)
+    data = data.reset_index(drop=True)
+    keys = pd.DataFrame(partition_values(df))
+    groups = keys.groupby(list(PARTITIONS)).indices
+    for (version, date), rows in groups.items():
+        part = os.path.join(path, 'version=' + version, 'date=' + date)
+        os.makedirs(part)
+        part = os.path.join(part, 'part-0' + FORMATS[fmt])
+        chunk = data.take(rows).reset_index(drop=True)
+        if fmt == 'parquet':
+            chunk.to_parquet(part, index=False)
+        else:
+            chunk.to_feather(part)
+    return({'columns': list(df.columns),
+            'partitioned': [c for c in PARTITIONS if c in df],
+            'responses': response_columns(df.columns)})
+
+
+def cpt_tables(cpt):
+    """Split CPT metrics into a one row frame of totals and a frame of
+    per question figures."""
+    totals = dict((k, v) for k, v in cpt.items()
+                  if not isinstance(v, pd.Series))
+    questions = pd.DataFrame(dict((k, v) for k, v in cpt.items()
+                                  if isinstance(v, pd.Series)))
+    questions.index.name = 'question'
+    return([pd.DataFrame([totals]), questions.reset_index()])
+
+
+def write_dataset(path, sfile, trans, cpt, fmt='parquet', keys=None):
+    """Write `sfile`, `trans` and the `cpt` tables to `path` as a dataset
+    partitioned by version and date; `keys` are the keypad keys of the
+    response codes, in code order."""
+    check_format(fmt)
+    path = os.path.abspath(path)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        metadata = {'format': fmt, 'tables': {}}
+        if keys is not None:
+            # Q columns are stored as codes; keep what they stand for
+            metadata['responses'] = {'keys': list(keys),
+                                     'unknown': len(keys),
+                                     'missing': MISSING}
+        for name, df in (('sfile', sfile), ('trans', trans)):
+            metadata['tables'][name] = write_table(
+                df, os.path.join(tmp, name), fmt)
+        totals, questions = cpt_tables(cpt)
+        for name, df in (('cpt_totals', totals),
+                         ('cpt_questions', questions)):
+            metadata['tables'][name] = write_table(
+                df, os.path.join(tmp, name), fmt)
+        metadata['cpt'] = list(cpt)
+        with open(os.path.join(tmp, METADATA), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        # Swap the finished dataset in for any older one
+        old = None
+        if os.path.exists(path):
+            old = '{}.{}.old'.format(path, os.getpid())
+            os.rename(path, old)
+        os.rename(tmp, path)
+        if old:
+            shutil.rmtree(old)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return(path)
+
+
+def read_metadata(path):
+    with open(os.path.join(path, METADATA)) as f:
+        return(json.load(f))
+
+
+def partitions(path, table='sfile'):
+    """The ``(version, date)`` partitions of `table`, as stored."""
+    found = []
+    root = os.path.join(path, table)
+    for v in sorted(os.listdir(root)):
+        for d in sorted(os.listdir(os.path.join(root, v))):
+            found.append((v.split('=', 1)[1], d.split('=', 1)[1]))
+    return(found)
+
+
+def decode(codes, responses):
+    """Keypad keys of response `codes`, given the dataset's `responses`."""
+    keys = np.array(responses['keys'] + ['?', None], dtype=object)
+    keys[responses['missing']] = None
+    return(keys[np.asarray(codes)])
+
+
+def read_dataset(path, table='sfile', versions=None, dates=None,
+                 columns=None, decode_responses=False):
+    """Load `columns` of `table` from the `versions` and `dates` partitions
+    of a dataset written by `write_dataset`, optionally as keypad keys."""
+    metadata = read_metadata(path)
+    fmt = metadata['format']
+    info = metadata['tables'][table]
+    if columns is None:
+        columns = info['columns']
+    stored = [c for c in columns if c not in info['partitioned']]
+    # Read one stored column even when only partitions are asked for, so
+    # there is a row for each record to fill them in on
+    read = stored or [c for c in info['columns']
+                      if c not in info['partitioned']][:1]
+    frames = []
+    for version, date in partitions(path, table):
+        if versions is not None and version not in versions:
+            continue
+        if dates is not None and date not in dates:
+            continue
+        part = os.path.join(path, table, 'version=' + version,
+                            'date=' + date, 'part-0' + FORMATS[fmt])
+        if fmt == 'parquet':
+            df = pd.read_parquet(part, columns=read)
+        else:
+            df = pd.read_feather(part, columns=read)
+        for col, value in (('version', version), ('date', date)):
+            if col in columns and col in info['partitioned']:
+                df[col] = None if value == MISSING_PARTITION else value
+        frames.append(df[columns])
+    if not frames:
+        return(pd.DataFrame(columns=columns))
+    df = pd.concat(frames, ignore_index=True)
+    if decode_responses:
+        for col in info.get('responses', []):
+            if col in df:
+                df[col] = decode(df[col].values, metadata['responses'])
+    return(df)
+
+
+def read_cpt(path):
+    """The CPT metrics of a dataset, as returned by the macro."""
+    totals = read_dataset(path, 'cpt_totals')
+    questions = read_dataset(path, 'cpt_questions').set_index('question')
+    questions.index.name = None
+    cpt = {}
+    for key in read_metadata(path)['cpt']:
+        if key in questions:
+            cpt[key] = questions[key].rename(None)
+        else:
+            cpt[key] = totals[key].iloc[0]
+    return(cpt)
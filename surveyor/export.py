@@ -0,0 +1,81 @@
+import os
+import threading
+
+# Rows written per chunk; progress is reported and cancellation checked
+# between chunks
+CHUNK_ROWS = 50000
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def write_csv(df, path, chunk_rows=CHUNK_ROWS, progress=None, cancel=None):
+    """Write `df` to `path` as CSV, `chunk_rows` rows at a time, until
+    `cancel` is set; returns ``[rows, nbytes]``."""
+    # Rows go to a temporary file, so `path` never holds a partial export
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    rows = 0
+    try:
+        with open(tmp, 'w', newline='') as f:
+            # An empty frame still gets its header written
+            for start in range(0, max(len(df), 1), chunk_rows):
+                if cancel is not None and cancel.is_set():
+                    raise ExportCancelled(path)
+                chunk = df.iloc[start:start + chunk_rows]
+                chunk.to_csv(f, index=False, header=(start == 0))
+                rows += len(chunk)
+                if progress:
+                    # Called as progress(rows, nbytes)
+                    progress(rows, f.tell())
+            nbytes = f.tell()
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return([rows, nbytes])
+
+
+class ExportJob(object):
+    """Write a frame to CSV on a background thread; see `write_csv`."""
+    def __init__(self, df, path, chunk_rows=CHUNK_ROWS, progress=None):
+        self.df = df
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.progress = progress
+        self.rows = 0
+        self.nbytes = 0
+        self.error = None
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+
+    def start(self):
+        self.thread.start()
+        return(self)
+
+    def run(self):
+        try:
+            write_csv(self.df, self.path, self.chunk_rows, self.report,
+                      self.cancelled)
+        except BaseException as e:
+            self.error = e
+
+    def report(self, rows, nbytes):
+        self.rows = rows
+        self.nbytes = nbytes
+        if self.progress:
+            self.progress(rows, nbytes)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def done(self):
+        return(not self.thread.is_alive())
+
+    def wait(self, timeout=None):
+        """Wait for the export to finish and raise its error, if any."""
+        self.thread.join(timeout)
+        if self.done() and self.error is not None:
+            raise self.error
+        return(self.done())
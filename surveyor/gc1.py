@@ -1,12 +1,26 @@
 import os
+import re
 import posixpath
 import pandas as pd
 import numpy as np
 import yaml
+import sys
 import argparse
+import contextlib
+import functools
+import hashlib
+import logging
+import time
+from collections import OrderedDict
 import formencode
+import cache
+import dataset
+import export
+import instrument
+import matrix
+from matrix import MISSING, RESPONSE_COLUMN, ResponseMatrix
+from concurrent.futures import ProcessPoolExecutor
 from formencode import validators
-from PySide import QtGui
 
 
 class ValidVersion(validators.FancyValidator):
@@ -134,6 +148,12 @@ class ValidConfig(formencode.Schema):
                     validators.ConfirmType(type=list, not_empty=True)])
 
 
+def check_options(options):
+    """Fail early on options that would only fail after processing."""
+    if options.get('dataset'):
+        dataset.check_format(options.get('dataset_format', 'parquet'))
+
+
 def load_config(path):
     vc = ValidConfig()
     with open(path) as f:
@@ -142,199 +162,570 @@ def load_config(path):
     return(config)
 
 
-def load_returns(returns_path):
-    gc1_returns_regex = r'.*Day.*[.]txt$'
-    gc1_date_regex = r'(\d{2}_\d{2}_\d{4})[.]txt'
-    gc1_version_regex = r'version[-_.]*([A-Z])'
-    gc1_columns = ['Account Number 1', 'Account Number 2',
-                   'Charge', 'Contact Result', 'First Name',
-                   'Last Name', 'Other 1', 'Other 2',
-                   'Phone #'] + (['Q' + str(i) for i in range(21)][1:21])
+log = logging.getLogger('gc1')
+# Most invalid answers shown per question when debugging
+BAD_SAMPLE = 20
+
+
+class LogFormatter(logging.Formatter):
+    """Formats records as ``[version=A question=Q2] message``."""
+    fields = ('version', 'question')
+
+    def format(self, record):
+        message = record.getMessage()
+        context = ' '.join('{}={}'.format(f, getattr(record, f))
+                           for f in self.fields
+                           if getattr(record, f, None) is not None)
+        if context:
+            message = '[{}] {}'.format(context, message)
+        return(message)
+
+
+class StdoutHandler(logging.Handler):
+    """Writes to whatever `sys.stdout` is when a record is emitted."""
+    def emit(self, record):
+        try:
+            sys.stdout.write(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+
+def log_to_stdout(level=logging.DEBUG):
+    """Send gc1 log records at `level` and above to stdout, for scripts."""
+    handler = None
+    for h in log.handlers:
+        if isinstance(h, StdoutHandler):
+            handler = h
+    if handler is None:
+        handler = StdoutHandler()
+        handler.setFormatter(LogFormatter())
+        log.addHandler(handler)
+    handler.setLevel(level)
+    log.setLevel(level)
+
+
+@contextlib.contextmanager
+def verbose_logging(verbose=True):
+    """Send gc1 debug records to stdout within the block if `verbose`,
+    restoring the logger's level and handlers on leaving."""
+    if not verbose:
+        yield
+        return
+    level = log.level
+    handlers = [(h, h.level) for h in log.handlers]
+    log_to_stdout(logging.DEBUG)
+    try:
+        yield
+    finally:
+        log.setLevel(level)
+        for h in log.handlers[:]:
+            if h not in dict(handlers):
+                log.removeHandler(h)
+        for h, h_level in handlers:
+            h.setLevel(h_level)
+
+
+# Keypad keys a GC1 respondent can press, in code order
+PHONE_KEYS = ('0', '1', '2', '3', '4', '5', '6', '7', '8', '9', '#', '*')
+# Response code for anything that is not a single keypad key
+UNKNOWN = len(PHONE_KEYS)
+KEY_CODES = dict((k, i) for i, k in enumerate(PHONE_KEYS))
+# Declared dtypes of GC1 return columns; Q1-Q20 hold keypad response codes
+GC1_SCHEMA = {
+    'Charge': 'float64',
+    'Seconds': 'float64',
+    'Contact Result': 'category',
+    'version': 'category',
+    'flag1': 'category',
+    'flag2': 'category',
+    'date': 'category',
+    'source': 'category',
+}
+GC1_SCHEMA.update(('Q' + str(i), 'int8') for i in range(1, 21))
+# Changes whenever the parsed layout does, so cached parses of an older
+# layout are never read back
+FORMAT_VERSION = hashlib.sha1(repr(
+    (sorted(GC1_SCHEMA.items()), PHONE_KEYS, MISSING, UNKNOWN)
+).encode('utf-8')).hexdigest()[:12]
+
+
+def key_code(key):
+    """Response code of a keypad key given in a config (e.g. 1 or '#')."""
+    return(KEY_CODES[str(key)])
+
+
+def key_codes(char_class):
+    """Response codes of the keys matched by a regex character class."""
+    _regex = re.compile(r'^[' + str(char_class) + ']$')
+    return([i for i, k in enumerate(PHONE_KEYS) if _regex.match(k)])
+
+
+def encode_responses(s):
+    """Convert keypad responses to int8 codes (`MISSING` when empty)."""
+    codes = s.map(KEY_CODES).fillna(UNKNOWN)
+    codes[s.isnull()] = MISSING
+    return(codes.astype(np.int8))
+
+
+def decode_responses(codes):
+    """Convert int8 response codes back to keypad keys."""
+    keys = np.array(PHONE_KEYS + ('?', None), dtype=object)
+    return(keys[np.asarray(codes)])
+
+
+class QuestionPlan(object):
+    """A validated question compiled into tables indexed by response code."""
+    def __init__(self, question):
+        self.question = question
+        self.name = question['name']
+        self.order = question['order']
+        self.version = question['version']
+        self.column = 'Q{}'.format(self.order)
+        self.codes = [key_code(i) for i in question['responses'].values()]
+        # Whether each response code is a valid answer
+        self.valid = matrix.lookup_table(self.codes)
+        # Label for each response code (NaN where there is none)
+        self.labels = np.full(len(self.valid), np.nan, dtype=object)
+        for nm, i in question['responses'].items():
+            self.labels[key_code(i)] = nm
+        self.onlyif = None
+        self.onlyif_valid = None
+        if question['onlyif']:
+            self.onlyif = 'Q' + str(question['onlyif']['question'])
+            self.onlyif_valid = matrix.lookup_table(
+                key_codes(question['onlyif']['equals']))
+
+
+class ConfigPlan(object):
+    """A validated config compiled once into `QuestionPlan`s."""
+    def __init__(self, config):
+        self.config = config
+        self.options = config['options']
+        check_options(self.options)
+        self.questions = [QuestionPlan(q) for q in config['questions']]
+        self.orders = sorted(set(q.order for q in self.questions))
+        self.valid_qs = ['Q' + str(q) for q in self.orders]
+
+    def for_version(self, version):
+        return([q for q in self.questions
+                if q.version == version or not q.version])
+
+    def label_names(self, version):
+        """Names of the labeled columns for `version`, in processing order."""
+        names = []
+        for order in self.orders:
+            for q in self.for_version(version):
+                if q.order == order and q.name not in names:
+                    names.append(q.name)
+        return(names)
+
+    def structure(self):
+        """The parts of the config that decide processed responses, or None
+        when an `onlyif` looks at a later question."""
+        structure = []
+        for q in self.questions:
+            onlyif = None
+            if q.onlyif:
+                if int(q.onlyif[1:]) >= q.order:
+                    return(None)
+                onlyif = [q.onlyif, np.flatnonzero(q.onlyif_valid).tolist()]
+            structure.append([q.order, q.version, onlyif,
+                              sorted(set(q.codes))])
+        return(structure)
+
+
+def compile_config(config):
+    """Compile a validated config, passing through one already compiled."""
+    if isinstance(config, ConfigPlan):
+        return(config)
+    return(ConfigPlan(config))
+
+
+def column_type(col):
+    if RESPONSE_COLUMN.match(col):
+        return('int8')
+    return(GC1_SCHEMA.get(col))
+
+
+def apply_schema(df):
+    """Convert the columns of a returns frame to their GC1 dtypes in place."""
+    for col in df.columns:
+        kind = column_type(col)
+        if kind is None or df[col].dtype.name == kind:
+            continue
+        if kind == 'int8':
+            df[col] = encode_responses(df[col])
+        else:
+            df[col] = df[col].astype(kind)
+    return(df)
+
+
+def constant_category(value, n):
+    """A length-`n` categorical holding a single value (or all missing)."""
+    if value is None:
+        return(pd.Categorical.from_codes(np.repeat(np.int8(-1), n), []))
+    return(pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), [value]))
+
+
+def parse_return(path):
+    """Parse a single GC1 return file from text into GC1 dtypes."""
+    return(apply_schema(pd.read_table(path, dtype=str)))
+
+
+def read_return(path, version=None, date=None, cache=None):
+    """Read a GC1 return file, through `cache` if given, tagged with its
+    version, date and `source` file name."""
+    if cache is None:
+        df = parse_return(path)
+    else:
+        df = cache.load(path, parse_return)
+    return(tag_return(df, version=version, date=date,
+                      source=os.path.basename(path)))
+
+
+def tag_return(df, **tags):
+    """A shallow copy of `df` with a constant categorical column for each
+    of `tags` (e.g. ``version='A'``); a tag of None is all missing."""
+    df = df.copy(deep=False)
+    for name, value in tags.items():
+        df[name] = constant_category(value, len(df))
+    return(df)
+
+
+@instrument.stage('combine_returns')
+def combine_returns(frames):
+    """Concatenate tagged return frames and add a `timestamp` column."""
+    if not frames:
+        return(pd.DataFrame())
+    categories = {}
+    for df in frames:
+        for col in df.columns:
+            if df[col].dtype.name == 'category':
+                cats = categories.setdefault(col, [])
+                cats.extend(c for c in df[col].cat.categories
+                            if c not in cats)
+    # Files without some response column get it as all missing, so the
+    # concat never turns int8 codes into floats
+    responses = matrix.response_columns(set().union(*(df.columns
+                                                      for df in frames)))
+    aligned = []
+    for df in frames:
+        df = df.copy(deep=False)
+        for col, cats in categories.items():
+            if col in df and df[col].dtype.name == 'category':
+                df[col] = df[col].cat.set_categories(cats)
+        for col in responses:
+            if col not in df:
+                df[col] = np.full(len(df), MISSING, dtype=np.int8)
+        aligned.append(df)
+    raw = pd.concat(aligned, ignore_index=True)
+    # Create an actual time-stamp value
+    ts = raw['date'].astype(object) + ' ' + raw['Time']
+    raw['timestamp'] = pd.to_datetime(ts, format="%Y-%m-%d %H:%M:%S %p")
+    instrument.note(rows=len(raw))
+    return(apply_schema(raw))
+
+
+def find_returns(returns_path):
+    """List ``(path, version, date)`` for each GC1 return file in
+    `returns_path`, in name order."""
+    gc1_returns_regex = re.compile(r'.*Day.*[.]txt$')
+    gc1_date_regex = re.compile(r'(\d{2}_\d{2}_\d{4})[.]txt')
+    gc1_version_regex = re.compile(r'version[-_.]*([A-Z])')
     if not os.path.isdir(returns_path):
         raise Exception("You must include a valid directory")
 
-    all_files = pd.Series(os.listdir(returns_path))
     # Filter out files using a regex to include only valid gc1 returns
-    files = all_files[all_files.str.contains(gc1_returns_regex)]
-    raw_dates = files.str.extract(gc1_date_regex)
-    dates = ['-'.join([str(d)[-4:], str(d)[0:2], str(d)[3:5]])
-             for d in raw_dates]
-    versions = files.str.extract(gc1_version_regex)
-    # Container for combined files
-    raw = pd.DataFrame()
-    for f, d, v in zip(files, dates, versions):
-        print("Loading {}".format(f))
-        df = pd.read_table(posixpath.join(returns_path, f),
-                           dtype=np.unicode_)
-        df['version'] = v
-        df['date'] = d
-        if not len(raw):
-            raw = df
-        else:
-            raw = pd.concat([raw, df])
-        # Create an actual time-stamp value
-        ts = raw['date'] + ' ' + raw['Time']
-        raw['timestamp'] = pd.to_datetime(ts,
-                                          format="%Y-%m-%d %H:%M:%S %p")
-        raw.reset_index(drop=True, inplace=True)
-    return(raw)
-
-
-def get_subquestion_index(m, mv, v_data):
-    if m['onlyif']:
-        if_q = 'Q' + m['onlyif']['question']
-        _regex = r'^[' + m['onlyif']['equals'] + ']$'
-        if_q = v_data[if_q].astype(str).str.replace(r'[.]0', '')
-        ix = if_q[if_q.str.contains(_regex)].index
-        if ix.isin(mv).any():
+    files = [f for f in sorted(os.listdir(returns_path))
+             if gc1_returns_regex.match(f)]
+    found = []
+    for f in files:
+        d = gc1_date_regex.search(f)
+        date = '-'.join([d.group(1)[-4:], d.group(1)[0:2],
+                         d.group(1)[3:5]]) if d else None
+        v = gc1_version_regex.search(f)
+        found.append((posixpath.join(returns_path, f),
+                      v.group(1) if v else None, date))
+    return(found)
+
+
+@instrument.stage('load_returns')
+def load_returns(returns_path, workers=None, cache=None):
+    """Load every GC1 return file in `returns_path` into one frame, parsed
+    by `workers` processes and through `cache` if given."""
+    files = find_returns(returns_path)
+    if not files:
+        return(pd.DataFrame())
+    for path, _, _ in files:
+        log.info('Loading %s', os.path.basename(path))
+    # Combine once; keeps memory and time linear in the number of files
+    data = combine_returns(read_returns(files, workers, cache))
+    instrument.note(rows=len(data), files=len(files))
+    return(data)
+
+
+@instrument.stage('read_returns')
+def read_returns(files, workers=None, cache=None):
+    """Read ``(path, version, date)`` return files into tagged frames."""
+    paths, versions, dates = zip(*files)
+    caches = [cache] * len(files)
+    if workers == 1 or len(files) == 1:
+        frames = [read_return(*args)
+                  for args in zip(paths, versions, dates, caches)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            frames = list(pool.map(read_return, paths, versions, dates,
+                                   caches))
+    if cache is not None:
+        cache.evict()
+    instrument.note(files=len(files), rows=sum(len(f) for f in frames))
+    return(frames)
+
+
+class ProgressThrottle(object):
+    """Forward progress reports to `callback` at most once per `interval`
+    seconds, and whenever `force` is set."""
+    def __init__(self, callback, interval=0.1):
+        self.callback = callback
+        self.interval = interval
+        self.last = None
+
+    def __call__(self, stage, version=None, question=None, rows=0,
+                 force=False):
+        now = time.time()
+        if (force or self.last is None or
+                now - self.last >= self.interval):
+            self.last = now
+            self.callback(stage, version, question, rows)
+
+
+def missing_labels(n):
+    """An object array of `n` NaN labels, all the same NaN object."""
+    labels = np.empty(n, dtype=object)
+    labels.fill(np.nan)
+    return(labels)
+
+
+def get_subquestion_index(m, mv, responses):
+    """Mask of the rows a question applies to, given its `onlyif` rule."""
+    if m.onlyif:
+        ix = m.onlyif_valid[responses.column(m.onlyif)]
+        if (ix & mv).any():
             raise Exception(("Duplicated mv indexes means that "
                             "Q{} subquestions were not mutually "
-                             "exclusive.".format(m['order'])))
+                             "exclusive.".format(m.order)))
     else:
-        ix = v_data.index
+        ix = np.ones(len(responses), dtype=bool)
     return(ix)
 
 
-def process_version(v_data, v_config, l_data, verbose, qs, pyside=True):
-    valid_qs = list(set([q['order'] for q in v_config]))
-    valid_qs.sort()
-    for j in valid_qs:
-        # extra row for pull script
-        v_data.loc[:, 'blank'] = np.nan
-        matches = [q for q in v_config if q['order'] == j]
-        mv = pd.Index([])
-        for m in matches:
-            if pyside:
-                QtGui.qApp.processEvents()
-            if verbose:
-                print('  ')
-                print('------------------------------')
-                print('  ')
-                print("Q{} ".format(j), end="")
-            if verbose and m['version']:
-                print('version-{}'.format(m['version']), end='')
-            if verbose and m['onlyif']:
-                oif = m['onlyif']
-                print(' (if Q{} == {})'.format(oif['question'],
-                      oif['equals']))
-            if verbose:
-                print('{}'.format(m['name']))
-            ix = get_subquestion_index(m, mv, v_data)
-            mv = mv | ix
-            # Find invalids
-            _regex = ''.join([str(i) for i in m['responses'].values()])
-            _regex = r'[^' + _regex + ']'
-            if verbose:
-                for nm, i in m['responses'].items():
-                    print("{}=>{}".format(i, nm))
-                print('regex={}'.format(_regex))
-            q_data = v_data.loc[ix, 'Q{}'.format(j)].dropna()
-            inv_ix = q_data[q_data.str.contains(_regex)].index
-            while len(inv_ix):
-                k = (j-1)
-                if verbose:
-                    print("({}) {} bad".format(
-                        q_data.ix[inv_ix].dropna().str.cat(),
-                        len(inv_ix)))
-                while k < len(qs):
-                    # eater function
-                    v_data.ix[inv_ix, k] = v_data.ix[inv_ix, k+1]
-                    k = k + 1
-                q_data = v_data.loc[ix, 'Q{}'.format(j)].dropna()
-                inv_ix = q_data[q_data.str.contains(_regex)].index
-            for nm, i in m['responses'].items():
-                lab_ix = q_data[q_data == str(i)].index
-                l_data.loc[lab_ix, m['name']] = nm
-        # PUSH
-        na_ix = v_data['Q{}'.format(j)][v_data['Q{}'.format(j)].isnull()].index
-        mv = mv | na_ix
-        if j != 1:
-            push_ix = v_data[~v_data.index.isin(mv)].index
-            k = len(qs)
-            if len(push_ix):
-                if verbose:
-                    print('!!!Push Question!!!'.format(j))
-                while k > (j-1):
-                    k_col = v_data.columns.values[k]
-                    k_minus1 = v_data.columns.values[(k-1)]
-                    v_data.loc[push_ix, k_col] = v_data.loc[push_ix, k_minus1]
-                    k = k - 1
-                    j_minus1 = v_data.columns.values[(j-1)]
-
-                v_data.loc[push_ix, j_minus1] = np.nan
+def process_version(v_data, v_config, l_data, verbose, qs, progress=None):
+    """Repair and label one version's responses in place; returns
+    ``[v_data, l_data]``."""
+    with verbose_logging(verbose):
+        debug = log.isEnabledFor(logging.DEBUG)
+        # Questions may be given as validated dicts or as a compiled plan
+        v_config = [q if isinstance(q, QuestionPlan) else QuestionPlan(q)
+                    for q in v_config]
+        # Work on a plain matrix of response codes, one column per question
+        if not isinstance(v_data, ResponseMatrix):
+            v_data = ResponseMatrix.from_frame(v_data, qs)
+        n = len(v_data)
+        labels = OrderedDict()
+        valid_qs = list(set([q.order for q in v_config]))
+        valid_qs.sort()
+        for j in valid_qs:
+            col = 'Q{}'.format(j)
+            matches = [q for q in v_config if q.order == j]
+            mv = np.zeros(n, dtype=bool)
+            for m in matches:
+                if progress:
+                    progress('process', question=m.name, rows=n)
+                context = {'version': m.version, 'question': m.column}
+                if debug and m.onlyif:
+                    oif = m.question['onlyif']
+                    log.debug('%s (if Q%s == %s)', m.name, oif['question'],
+                              oif['equals'], extra=context)
+                elif debug:
+                    log.debug('%s', m.name, extra=context)
+                ix = get_subquestion_index(m, mv, v_data)
+                mv |= ix
+                # Find invalids
+                if debug:
+                    log.debug('responses: %s', ', '.join(
+                        '{}=>{}'.format(i, nm)
+                        for nm, i in m.question['responses'].items()),
+                        extra=context)
+                    q_data = v_data.column(col)[ix]
+                    bad = np.flatnonzero(~m.valid[q_data] &
+                                         (q_data != MISSING))
+                    if len(bad):
+                        sample = q_data[bad[:BAD_SAMPLE]]
+                        log.debug('%d bad (%s%s)', len(bad),
+                                  ''.join(decode_responses(sample)),
+                                  '...' if len(bad) > BAD_SAMPLE else '',
+                                  extra=context)
+                # eater function
+                with instrument.span('eater', question=m.name):
+                    v_data.eat_invalid(np.flatnonzero(ix), col, m.valid)
+                q_data = v_data.column(col)
+                if m.name not in labels:
+                    labels[m.name] = missing_labels(n)
+                lab_ix = ix & m.valid[q_data]
+                labels[m.name][lab_ix] = m.labels[q_data[lab_ix]]
+            # PUSH
+            mv |= v_data.column(col) == MISSING
+            if j != 1:
+                push_ix = ~mv
+                if push_ix.any():
+                    if debug:
+                        log.debug('Push question: %d rows', push_ix.sum(),
+                                  extra={'question': col})
+                    with instrument.span('push', question=col):
+                        v_data.push_right(push_ix, col)
+        for name, labeled in labels.items():
+            l_data[name] = labeled
+        return([v_data, l_data])
+
+
+def relabel_version(v_data, v_config, l_data):
+    """Label one version's responses already processed with a config of
+    the same `ConfigPlan.structure`; returns ``[v_data, l_data]``."""
+    n = len(v_data)
+    labels = OrderedDict()
+    for j in sorted(set(q.order for q in v_config)):
+        for m in [q for q in v_config if q.order == j]:
+            if m.onlyif:
+                ix = m.onlyif_valid[v_data.column(m.onlyif)]
+            else:
+                ix = np.ones(n, dtype=bool)
+            q_data = v_data.column(m.column)
+            if m.name not in labels:
+                labels[m.name] = missing_labels(n)
+            lab_ix = ix & m.valid[q_data]
+            labels[m.name][lab_ix] = m.labels[q_data[lab_ix]]
+    for name, labeled in labels.items():
+        l_data[name] = labeled
     return([v_data, l_data])
 
 
+# Contact results that show a number works; a respondent is counted as
+# invalid when all of their calls were 'invalid' and none of these
+REACHED_RESULTS = ('answered', 'busy', 'fax', 'machine', 'noAnswer')
+
+
+class CallPerformance(object):
+    """Call performance totals: counts and sums, `Seconds` spread and call
+    counts per respondent (``ids[0]``)."""
+    columns = ['attempts', 'pickup', 'reached', 'invalid']
+
+    def __init__(self, respondents, completes, verified=0, removes=0,
+                 cost=0.0, seconds=(0, 0.0, 0.0)):
+        self.respondents = respondents
+        self.completes = completes
+        self.verified = verified
+        self.removes = removes
+        self.cost = cost
+        self.seconds = seconds
+
+    @classmethod
+    def from_calls(cls, trans, labeled, valid_qs, respondents):
+        """Totals for the calls in `trans`, given their `columns` counts per
+        respondent."""
+        answered = trans[valid_qs].values != MISSING
+        seconds = trans['Seconds'].dropna().values
+        mean = seconds.mean() if len(seconds) else 0.0
+        return(cls(respondents[cls.columns],
+                   pd.Series(answered.sum(axis=0), index=valid_qs),
+                   int((trans['Q1'].values == key_code(1)).sum()),
+                   int(labeled['remove'].count()),
+                   trans['Charge'].sum(),
+                   (len(seconds), mean, ((seconds - mean) ** 2).sum())))
+
+    def invalid(self):
+        """Whether each respondent only had invalid calls."""
+        r = self.respondents
+        return(r.index.notnull() & (r['reached'] == 0) & (r['invalid'] >= 1))
+
+    def out(self):
+        """The totals reported by `call_performance_information`."""
+        r = self.respondents
+        n, mean, m2 = self.seconds
+        out = {}
+        # Total uniques attempted
+        out['uniques'] = len(r)
+        # Number of passes through list
+        out['passes'] = r['attempts'][r.index.notnull()].max()
+        # Total unique pickups
+        out['pickups'] = int((r['pickup'] > 0).sum())
+        # Total uniques who passed verification
+        out['verified'] = self.verified
+        # Remove requests
+        out['removes'] = self.removes
+        # Invalids
+        out['invalids'] = int(self.invalid().sum())
+        # Cost
+        out['cost'] = self.cost
+        # Q completes
+        out['completes'] = self.completes
+        # Cost per complete
+        out['cost_per'] = self.cost / self.completes
+        # Average Time
+        out['mean_time'] = mean if n else np.nan
+        out['sd_time'] = np.sqrt(m2 / (n - 1)) if n > 1 else np.nan
+        return(out)
+
+
+@instrument.stage('call_performance_information')
 def call_performance_information(trans, labeled, ids, valid_qs):
-    df = trans[ids].drop_duplicates(ids)
-    out = {}
-    # Total uniques attempted
-    out['uniques'] = len(trans[ids[0]].unique())
-    # Number of passes through list
-    out['passes'] = trans[ids[0]].value_counts().max()
-    # Total unique pickups
-    out['pickups'] = len(trans[trans['Contact Result'] == 'answered']
-                         [ids[0]].unique())
-    answer_ids = trans[trans['Contact Result'] == 'answered'][ids[0]]
-    df['pickup'] = np.where(df[ids[0]].isin(answer_ids), 1, 0)
-    # Total uniques who passed verification
-    out['verified'] = len(trans[trans.Q1 == '1'])
-    # Remove requests
-    out['removes'] = len(labeled['remove'].dropna())
-    # Invalids
-    inv = pd.crosstab(trans[ids[0]], trans['Contact Result'])
-    mask = ((inv['answered'] == 0) & (inv['busy'] == 0) &
-            (inv['fax'] == 0) & (inv['machine'] == 0) &
-            (inv['noAnswer'] == 0) & (inv['invalid'] >= 1))
-    out['invalids'] = len(inv[mask])
-    invalid_ids = inv[mask].index
-    df['invalid'] = np.where(df[ids[0]].isin(invalid_ids), 1, 0)
-    # attempts
-    attempts = trans[ids[0]].value_counts()
-    attempts = pd.DataFrame({ids[0]: attempts.index,
-                            'attempts': attempts})
-    df = pd.merge(df, attempts, on=ids[0])
-    # Invalids
-    out['invalids'] = len(inv[mask])
-    invalid_ids = inv[mask].index
-    df['invalid'] = np.where(df[ids[0]].isin(invalid_ids), 1, 0)
-    # Cost
-    out['cost'] = trans.Charge.astype(np.float_).sum()
-    trans['Charge']
-    # Q completes
-    out['completes'] = pd.Series([len(trans[q].dropna()) for q in valid_qs],
-                                 index=valid_qs)
-    # Cost per complete
-    out['cost_per'] = pd.Series(out['cost'] /
-                                [len(trans[q].dropna()) for q in valid_qs],
-                                index=valid_qs)
-    # Average Time
-    out['mean_time'] = trans['Seconds'].astype(float).mean()
-    out['sd_time'] = trans['Seconds'].astype(float).std()
-    trans['Charge'] = trans['Charge'].astype(float)
-    cost = trans[[ids[0], 'Charge']].groupby(ids[0]).sum()
-    cost = pd.DataFrame({ids[0]: cost.index,
-                        'cost': cost['Charge']})
-    df = pd.merge(df, cost, on=ids[0])
-    # Answers
-    trans['answers'] = trans[valid_qs].count(axis=1)
-    trans.sort(['answers'], ascending=False, inplace=True)
-    answers = trans.drop_duplicates(ids)[ids+['answers']]
-    df = pd.merge(df, answers, on=ids)
-    # answers 2 (not exactly accurate, but good enough to sort)
-    labeled['answers2'] = labeled.count(axis=1)
-    labeled = labeled.sort_index(by='answers2', ascending=False)
-    longest = labeled.drop_duplicates(ids)
-    del longest['answers2']
+    """Summarise call performance in one grouped pass per respondent;
+    returns ``[sfile, out]``."""
+    instrument.note(rows=len(trans))
+    key = ids[0]
+    result = trans['Contact Result']
+    calls = trans[ids].copy()
+    calls['attempts'] = 1
+    calls['pickup'] = (result == 'answered').values
+    calls['reached'] = result.isin(REACHED_RESULTS).values
+    calls['invalid'] = (result == 'invalid').values
+    calls['cost'] = trans['Charge'].values
+    calls['answers'] = (trans[valid_qs].values != MISSING).sum(axis=1)
+    # One pass over the calls, then roll respondents up to ids[0]
+    per_pair = calls.groupby(ids, sort=False, dropna=False).agg(
+        {'attempts': 'sum', 'pickup': 'max', 'reached': 'sum',
+         'invalid': 'sum', 'cost': 'sum', 'answers': 'max'}).reset_index()
+    del calls
+    per_id = per_pair.groupby(key, sort=False, dropna=False)[
+        ['attempts', 'pickup', 'reached', 'invalid', 'cost']].sum()
+    totals = CallPerformance.from_calls(trans, labeled, valid_qs, per_id)
+    out = totals.out()
+    # Per respondent figures; calls without ids[0] are left out
+    pairs = per_pair[per_pair[key].notnull().values]
+    rollup = per_id.reindex(pairs[key])
+    df = pairs[ids].copy()
+    df['pickup'] = (rollup['pickup'].values > 0).astype(np.int64)
+    df['invalid'] = totals.invalid().reindex(pairs[key]).values.astype(
+        np.int64)
+    df['attempts'] = rollup['attempts'].values
+    df['cost'] = rollup['cost'].values
+    df['answers'] = pairs['answers'].values
+    # Longest labeled row per respondent (earliest on ties)
+    counts = labeled.count(axis=1).values
+    longest = labeled.iloc[np.argsort(-counts, kind='mergesort')]
+    longest = longest.drop_duplicates(ids)
     sfile = pd.merge(longest, df, on=ids)
-    sfile.sort_index(by='timestamp', inplace=True)
+    if 'timestamp' in sfile:
+        sfile.sort_values('timestamp', kind='mergesort', inplace=True)
     cols = pd.Series(ids + df.columns.tolist() + longest.columns.tolist())
     cols = cols.drop_duplicates().tolist()
     sfile = sfile[cols]
     return([sfile, out])
 
 
-def macro(data, config, verbose=False):
+@instrument.stage('prepare_returns')
+def prepare_returns(data, plan):
+    """Type `data` in place and derive ``[ids, resp_data, labels,
+    versions]`` from it for processing."""
     pd.options.mode.chained_assignment = None
     # Check to make sure no duplicated subquestions
     assert 'Account Number 1' in data
@@ -344,7 +735,9 @@ def macro(data, config, verbose=False):
     assert 'Phone #' in data
     assert 'Seconds' in data
     assert 'Time' in data
-    opts = config['options']
+    # Make sure responses are codes and metadata columns are categorical
+    apply_schema(data)
+    opts = plan.options
     ids = []
     if 'id1' in opts:
         data[opts['id1']] = data['Account Number 1']
@@ -355,24 +748,8 @@ def macro(data, config, verbose=False):
     if 'id1' not in opts and 'id2' not in opts:
         data['id'] = data['Account Number 1']
         ids.append('id')
-    # The yaml templates for each question
-    q_template = config['questions']
-    # Find all valid qs -- convert to set to find unique vals, and back to list
-    valid_qs = list(set([q['order'] for q in q_template]))
-    valid_qs.sort()
-    valid_qs = ['Q' + str(q) for q in valid_qs]
-    # Reduce to just response data
-    resp_data = data.filter(regex=r'^Q\d+$')
-    # Find valid questions
-    cols = pd.Series(resp_data.columns.tolist()).str.replace('Q', '')
-    cols = cols.astype(int)
-    # Sort into ascending order (important)
-    cols.sort()
-    cols = ('Q' + cols.map(str)).tolist()
-    # Re-order based on ascending order
-    resp_data = resp_data[cols]
-    # List of valid questions
-    qs = resp_data.columns.tolist()
+    # Reduce to just response data, in ascending question order
+    resp_data = ResponseMatrix.from_frame(data)
     # Prepare versions
     # if versions are all null, set them to '---'
     if 'version' not in data:
@@ -381,8 +758,6 @@ def macro(data, config, verbose=False):
         data['version'] = '---'
     # All unique versions
     versions = tuple(data.version.unique())
-    # Storage containers for processed output
-    raw_out, labeled_out = {}, {}
     # Base info that labels will be appended onto
     label_vars = ids + ['version']
     if 'flag1' in data:
@@ -397,60 +772,362 @@ def macro(data, config, verbose=False):
         if 'date' in data:
             label_vars.append('date')
     labels = data[label_vars].copy()
-    # Run the macro once for each version
-    for v in versions:
-        if verbose:
-            print("Version {}".format(v))
-        # Raw response data
-        v_data = resp_data[data.version == v]
-        # Base label data
-        l_data = labels[labels.version == v]
-        v_config = [q for q in q_template
-                    if q['version'] == v or not q['version']]
-        raw_out[v], labeled_out[v] = process_version(v_data, v_config,
-                                                     l_data, verbose, qs)
-    # Combine the data sets
-    raw, labeled = [], []
+    instrument.note(rows=len(data))
+    return([ids, resp_data, labels, versions])
+
+
+def version_groups(labels, versions):
+    """Row positions ordered by version and the slice of them holding each
+    of `versions`; returns ``[order, groups]``."""
+    known = [v for v in versions if pd.notnull(v)]
+    codes = pd.Categorical(labels['version'], categories=known).codes
+    rows = np.flatnonzero(codes >= 0)
+    order = rows[np.argsort(codes[rows], kind='mergesort')]
+    bounds = np.searchsorted(codes[order], np.arange(len(known) + 1))
+    groups = []
     for v in versions:
-        if not len(raw):
-            raw = raw_out[v]
-            labeled = labeled_out[v]
+        if pd.isnull(v):
+            groups.append(slice(0, 0))
         else:
-            raw = pd.concat([raw, raw_out[v]])
-            labeled = pd.concat([labeled, labeled_out[v]])
-    # Transactional File; remove old data
-    data = data.drop(qs, axis=1)
-    trans = pd.merge(data, raw[valid_qs], left_index=True, right_index=True)
-    if verbose:
-        print("Removing duplicates:")
-        print("Pre:  {}".format(len(trans)))
-    trans.drop_duplicates(inplace=True)
-    if verbose:
-        print("Post: {}".format(len(trans)))
+            i = known.index(v)
+            groups.append(slice(bounds[i], bounds[i + 1]))
+    return([order, groups])
+
+
+def assemble_labels(labels, order, groups, results):
+    """The rows of `labels` in `order`, with the label arrays of each
+    version group in `results` as columns."""
+    labeled = labels.iloc[order]
+    names = []
+    for l_data in results:
+        names.extend(n for n in l_data if n not in names)
+    for name in names:
+        column = missing_labels(len(order))
+        for group, l_data in zip(groups, results):
+            if name in l_data:
+                column[group] = l_data[name]
+        labeled[name] = column
+    return(labeled)
+
+
+@instrument.stage('process_versions')
+def process_versions(resp_data, labels, versions, plan, verbose=False,
+                     workers=1, progress=None):
+    """Run `process_version` for each version on slices of one response
+    array; returns ``[raw, labeled]`` grouped by version."""
+    instrument.note(rows=len(resp_data), versions=len(versions),
+                    workers=workers)
+    # List of valid questions
+    qs = resp_data.names
+    order, groups = version_groups(labels, versions)
+    raw = resp_data.take(order)
+    # Response slice, config and label columns for each version
+    jobs = [(ResponseMatrix(raw.values[g], raw.index[g], qs),
+             plan.for_version(v), OrderedDict())
+            for v, g in zip(versions, groups)]
+    # Run the macro once for each version
+    if workers == 1 or len(versions) < 2:
+        for v, (v_data, v_config, l_data) in zip(versions, jobs):
+            log.debug('Processing', extra={'version': v})
+            v_progress = None
+            if progress:
+                v_progress = functools.partial(progress, version=v)
+            with instrument.span('process_version', version=v,
+                                 rows=len(v_data)):
+                process_version(v_data, v_config, l_data, verbose, qs,
+                                v_progress)
+            if progress:
+                progress('process', v, rows=len(v_data), force=True)
+        results = [l_data for _, _, l_data in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(process_version, v_data, v_config,
+                                   l_data, verbose, qs)
+                       for v_data, v_config, l_data in jobs]
+            results = []
+            for v, g, f in zip(versions, groups, futures):
+                v_data, l_data = f.result()
+                # Worker results come back as copies
+                raw.values[g] = v_data.values
+                results.append(l_data)
+                if progress:
+                    progress('process', v, rows=len(v_data), force=True)
+    del jobs
+    labeled = assemble_labels(labels, order, groups, results)
+    return([raw, labeled])
+
+
+@instrument.stage('relabel_versions')
+def relabel_versions(raw, labels, versions, plan):
+    """Run `relabel_version` for each version; returns the labeled frame
+    grouped by version."""
+    order, groups = version_groups(labels, versions)
+    raw = raw.take(order)
+    results = []
+    for v, g in zip(versions, groups):
+        v_data = ResponseMatrix(raw.values[g], raw.index[g], raw.names)
+        results.append(relabel_version(v_data, plan.for_version(v),
+                                       OrderedDict())[1])
+    return(assemble_labels(labels, order, groups, results))
+
+
+def row_fingerprints(df, columns=None):
+    """A 64-bit hash of each row of `df` over `columns` (default all)."""
+    if columns is None:
+        columns = df.columns
+    hashes = np.zeros(len(df), dtype=np.uint64)
+    for col in columns:
+        hashes *= np.uint64(1000003)
+        hashes ^= pd.util.hash_pandas_object(df[col], index=False).values
+    return(hashes)
+
+
+def first_occurrences(codes):
+    """Duplicate mask and first occurrence of each duplicate, given row
+    group codes numbered in order of first appearance."""
+    seen = np.maximum.accumulate(codes)
+    dup = np.zeros(len(codes), dtype=bool)
+    dup[1:] = codes[1:] <= seen[:-1]
+    first = np.flatnonzero(~dup)
+    return([dup, first[codes[dup]]])
+
+
+@instrument.stage('drop_duplicate_calls')
+def drop_duplicate_calls(trans, check=False, source='source'):
+    """Drop repeated calls by a fingerprint of every column but `source`,
+    checked exactly with `check`; returns ``[trans, report]``."""
+    columns = [c for c in trans.columns if c != source]
+    codes, _ = pd.factorize(row_fingerprints(trans, columns))
+    dup, orig = first_occurrences(codes)
+    if check and dup.any():
+        pos = np.flatnonzero(dup)
+        same = np.ones(len(pos), dtype=bool)
+        for col in columns:
+            a = trans[col].iloc[pos].to_numpy()
+            b = trans[col].iloc[orig].to_numpy()
+            same &= (a == b) | (pd.isnull(a) & pd.isnull(b))
+        if not same.all():
+            log.warning('%d row fingerprint collisions, comparing rows '
+                        'exactly', (~same).sum())
+            codes = trans.groupby(columns, sort=False, dropna=False,
+                                  observed=True).ngroup().values
+            dup, orig = first_occurrences(codes)
+    report = {'rows': len(trans), 'duplicates': int(dup.sum()),
+              'overlapping': 0, 'files': pd.Series([], dtype=np.int64)}
+    if source in trans and dup.any():
+        files = trans[source].to_numpy()
+        overlap = files[dup] != files[orig]
+        report['overlapping'] = int(overlap.sum())
+        report['files'] = pd.Series(files[dup][overlap]).value_counts()
+    if dup.any():
+        trans = trans[~dup]
+    instrument.note(rows=report['rows'], duplicates=report['duplicates'])
+    return([trans, report])
+
+
+@instrument.stage('transactions')
+def transactions(data, raw, valid_qs):
+    """`data` with the processed `valid_qs` responses from `raw` in place
+    of its own, for the rows in `raw`."""
+    # Position in `raw` of each row of `data`, -1 if it is not there
+    where = np.full(len(data), -1, dtype=np.intp)
+    where[data.index.get_indexer(raw.index)] = np.arange(len(raw))
+    if (where >= 0).all():
+        rows = where
+        columns = OrderedDict((c, data[c]) for c in data.columns
+                              if c not in raw.columns)
+        index = data.index
+    else:
+        kept = np.flatnonzero(where >= 0)
+        rows = where[kept]
+        columns = OrderedDict((c, data[c].iloc[kept]) for c in data.columns
+                              if c not in raw.columns)
+        index = data.index[kept]
+    for q in valid_qs:
+        values = raw.column(q)[rows]
+        if ((values < MISSING) | (values > UNKNOWN)).any():
+            raise Exception("{} holds codes that are not responses".format(q))
+        columns[q] = values
+    return(pd.DataFrame(columns, index=index, copy=False))
+
+
+@instrument.stage('finish_returns')
+def finish_returns(data, raw, labeled, ids, plan, progress=None):
+    """Drop duplicate calls and run the call performance tracker; returns
+    ``[sfile, cpt]``."""
+    opts = plan.options
+    trans = transactions(data, raw, plan.valid_qs)
+    trans, report = drop_duplicate_calls(
+        trans, opts.get('check_duplicates', False))
+    log.debug('Removed duplicates: %d rows before, %d after',
+              report['rows'], len(trans))
+    if report['overlapping']:
+        log.info('%d duplicate calls repeat calls from other return files',
+                 report['overlapping'])
+        for f, n in report['files'].items():
+            log.debug('%d duplicate calls in %s', n, f)
+    if progress:
+        progress('dedup', rows=len(trans), force=True)
     # Call performance tracker
-    sfile, cpt = call_performance_information(trans, labeled, ids, valid_qs)
+    sfile, cpt = call_performance_information(trans, labeled, ids,
+                                              plan.valid_qs)
+    if progress:
+        progress('cpt', rows=len(sfile), force=True)
+    if opts.get('dataset'):
+        with instrument.span('write_dataset'):
+            path = dataset.write_dataset(
+                opts['dataset'], sfile, trans, cpt,
+                opts.get('dataset_format', 'parquet'), PHONE_KEYS)
+        log.debug('Saved dataset at %s', path)
     return([sfile, cpt])
 
 
+@instrument.stage('macro')
+def macro(data, config, verbose=False, workers=1, progress=None,
+          progress_interval=0.1):
+    """Process GC1 returns with a config, returning ``[sfile, cpt]``;
+    versions run on `workers` processes and `progress` is throttled."""
+    if progress:
+        progress = ProgressThrottle(progress, progress_interval)
+    instrument.note(rows=len(data))
+    with verbose_logging(verbose):
+        plan = compile_config(config)
+        ids, resp_data, labels, versions = prepare_returns(data, plan)
+        raw, labeled = process_versions(resp_data, labels, versions, plan,
+                                        verbose, workers, progress)
+        return(finish_returns(data, raw, labeled, ids, plan, progress))
+
+
+def run(config_file, verbose=False, workers=None, use_cache=True,
+        checkpoint_dir=None, dataset_dir=None, report=False,
+        trace_memory=False):
+    """Process the returns named in a config file and save the results;
+    returns the rows saved and the outputs written."""
+    log.debug('Loading config file: %s', config_file)
+    config = load_config(config_file)
+    assert 'returns' in config['options']
+    assert 'save_as' in config['options']
+    if dataset_dir:
+        config['options']['dataset'] = dataset_dir
+    check_options(config['options'])
+    recorder = instrument.start(trace_memory) if report else None
+    try:
+        with instrument.span('run', config=config_file):
+            summary = save_results(config, verbose, workers, use_cache,
+                                   checkpoint_dir)
+    finally:
+        if recorder is not None:
+            instrument.stop()
+            path = recorder.write(
+                instrument.report_path(config['options']['save_as']))
+            log.info('Run report saved at %s', path)
+    if recorder is not None:
+        summary['outputs'].append(path)
+    return(summary)
+
+
+def save_results(config, verbose=False, workers=None, use_cache=True,
+                 checkpoint_dir=None):
+    """The processing and saving part of `run`, given a loaded config."""
+    returns_cache = None
+    if use_cache:
+        returns_cache = cache.ReturnsCache(
+            config['options'].get('cache', cache.DEFAULT_CACHE_DIR),
+            version=FORMAT_VERSION)
+    checkpoint_dir = checkpoint_dir or config['options'].get('checkpoint')
+    if checkpoint_dir:
+        import checkpoint
+        df, cpt = checkpoint.process(
+            find_returns(config['options']['returns']), config,
+            checkpoint_dir, verbose, workers, returns_cache)
+    else:
+        data = load_returns(config['options']['returns'], workers,
+                            returns_cache)
+        df, cpt = macro(data, config, verbose, workers)
+    outputs = [config['options']['save_as']]
+    # Write the processed returns in the background while the CPT is saved
+    job = export.ExportJob(df, config['options']['save_as'],
+                           progress=functools.partial(
+                               log.debug, 'Saved %d rows (%d bytes)'))
+    with instrument.span('export', rows=len(df)):
+        job.start()
+        if 'cpt' in config['options']:
+            with open(config['options']['cpt'], "w") as text_file:
+                text_file.write("{}".format(cpt))
+            outputs.append(config['options']['cpt'])
+        try:
+            job.wait()
+        except KeyboardInterrupt:
+            job.cancel()
+            job.thread.join()
+            raise
+    log.debug('Saved at %s', config['options']['save_as'])
+    if config['options'].get('dataset'):
+        outputs.append(config['options']['dataset'])
+    log.debug('Finished')
+    return({'rows': job.rows, 'outputs': outputs})
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Process gc1 segment returns')
     parser.add_argument('-v', action='store_true', dest='verbose',
                         help='print verbose output to stdout', default=False)
+    parser.add_argument('-j', action='store', type=int, dest='workers',
+                        help='number of worker processes',
+                        default=None)
+    parser.add_argument('--no-cache', action='store_false', dest='cache',
+                        help='always parse return files from text',
+                        default=True)
+    parser.add_argument('--checkpoint', action='store', dest='checkpoint',
+                        metavar='DIR',
+                        help='directory to keep processed returns in, so '
+                        'only new return files are processed on later runs',
+                        default=None)
+    parser.add_argument('--dataset', action='store', dest='dataset',
+                        metavar='DIR',
+                        help='also save results as a partitioned dataset',
+                        default=None)
+    parser.add_argument('--report', action='store_true', dest='report',
+                        help='save a JSON report of the time and memory '
+                        'each stage took next to the output',
+                        default=False)
+    parser.add_argument('--trace-memory', action='store_true',
+                        dest='trace_memory',
+                        help='add tracemalloc figures to the report '
+                        '(slower)', default=False)
+    parser.add_argument('--profile', action='store', dest='profile',
+                        metavar='PREFIX',
+                        help='profile the run and save PREFIX.pstats and '
+                        'PREFIX.collapsed (runs with -j 1 unless -j is '
+                        'given)', default=None)
+    parser.add_argument('--profile-mode', action='store',
+                        dest='profile_mode', choices=['deterministic',
+                                                      'sampling'],
+                        help='profiler to use (default: deterministic)',
+                        default='deterministic')
+    parser.add_argument('--profile-top', action='store', type=int,
+                        dest='profile_top', metavar='N',
+                        help='hot functions to print (default: 20)',
+                        default=20)
     parser.add_argument('config_file', action='store',
                         help='path to config file')
     args = parser.parse_args()
-    if args.verbose:
-        print("Loading config file: {}".format(args.config_file))
-    config = load_config(args.config_file)
-    assert 'returns' in config['options']
-    data = load_returns(config['options']['returns'])
-    df, cpt = macro(data, config, args.verbose)
-    assert 'save_as' in config['options']
-    df.to_csv(config['options']['save_as'], index=False)
-    if args.verbose:
-        print("Saved at {}".format(config['options']['save_as']))
-    if 'cpt' in config['options']:
-        with open(config['options']['cpt'], "w") as text_file:
-            text_file.write("{}".format(cpt))
-    if args.verbose:
-        print("Finished")
+    log_to_stdout(logging.DEBUG if args.verbose else logging.INFO)
+    workers = args.workers
+    if args.profile and workers is None:
+        # Work done in worker processes is not seen by the profiler
+        workers = 1
+    call = functools.partial(
+        run, args.config_file, args.verbose, workers, args.cache,
+        args.checkpoint, args.dataset, args.report or args.trace_memory,
+        args.trace_memory)
+    if args.profile:
+        import profiling
+        _, paths, text = profiling.profile(call, args.profile,
+                                           args.profile_mode,
+                                           args.profile_top)
+        print(text)
+        for path in paths:
+            log.info('Profile saved at %s', path)
+    else:
+        call()
@@ -0,0 +1,194 @@
+import os
+import sys
+import json
+import time
+import datetime
+import functools
+import threading
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The active `Recorder`; spans are only recorded while one is set
+_recorder = None
+# Per span memory peaks need `tracemalloc.reset_peak` (Python 3.9)
+TRACE_PEAKS = hasattr(tracemalloc, 'reset_peak')
+
+
+def max_rss():
+    """Peak resident set size of this process so far, in bytes."""
+    if resource is None:
+        return(None)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return(rss if sys.platform == 'darwin' else rss * 1024)
+
+
+class NullSpan(object):
+    """Stands in for a `Span` when nothing is being recorded."""
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc):
+        return(False)
+
+    def set(self, **info):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+    """A timed stage of a run and the stages nested in it: wall and CPU
+    seconds, peak RSS and, when traced, memory used by the stage."""
+    def __init__(self, recorder, name, info):
+        self.recorder = recorder
+        self.name = name
+        self.info = info
+        self.children = []
+        self.wall = None
+        self.cpu = None
+        self.max_rss = None
+        self.memory_delta = None
+        self.memory_peak = None
+
+    def set(self, **info):
+        self.info.update(info)
+
+    def __enter__(self):
+        self.recorder.enter(self)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return(self)
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self._wall
+        self.cpu = time.process_time() - self._cpu
+        if exc[0] is not None:
+            self.info['error'] = exc[0].__name__
+        self.recorder.exit(self)
+        return(False)
+
+    def to_dict(self):
+        span = {'name': self.name, 'wall': self.wall, 'cpu': self.cpu,
+                'max_rss': self.max_rss}
+        if self.memory_delta is not None:
+            span['memory_delta'] = self.memory_delta
+        if self.memory_peak is not None:
+            span['memory_peak'] = self.memory_peak
+        span.update(self.info)
+        span['children'] = [c.to_dict() for c in self.children]
+        return(span)
+
+
+class Recorder(object):
+    """Collects the `Span`s of a run from the thread that started it;
+    `trace_memory` (slow) adds each span's memory use."""
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        # Whether tracemalloc was started for this recording
+        self.tracing = False
+        self.thread = threading.get_ident()
+        self.spans = []
+        self.stack = []
+        self.started = datetime.datetime.now()
+        self._wall = time.perf_counter()
+
+    def span(self, name, **info):
+        if threading.get_ident() != self.thread:
+            return(NULL_SPAN)
+        return(Span(self, name, info))
+
+    def enter(self, span):
+        (self.stack[-1].children if self.stack else self.spans).append(span)
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                parent = self.stack[-1]
+                parent._peak = max(parent._peak, peak)
+            if TRACE_PEAKS:
+                tracemalloc.reset_peak()
+            span._start = span._peak = current
+        self.stack.append(span)
+
+    def exit(self, span):
+        self.stack.pop()
+        span.max_rss = max_rss()
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            span._peak = max(span._peak, peak)
+            span.memory_delta = current - span._start
+            if TRACE_PEAKS:
+                span.memory_peak = span._peak - span._start
+            if self.stack:
+                parent = self.stack[-1]
+                parent._peak = max(parent._peak, span._peak)
+
+    def report(self):
+        return({'started': self.started.isoformat(),
+                'wall': time.perf_counter() - self._wall,
+                'max_rss': max_rss(),
+                'trace_memory': self.trace_memory,
+                'spans': [s.to_dict() for s in self.spans]})
+
+    def write(self, path):
+        """Write the report as JSON to `path`; returns `path`."""
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+        return(path)
+
+
+def start(trace_memory=False):
+    """Start recording spans; returns the new `Recorder`."""
+    global _recorder
+    _recorder = Recorder(trace_memory)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _recorder.tracing = True
+    return(_recorder)
+
+
+def stop():
+    """Stop recording; returns the `Recorder` that was active, if any."""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None and recorder.tracing:
+        tracemalloc.stop()
+    return(recorder)
+
+
+def span(name, **info):
+    """A context manager timing the stage `name` of the current run;
+    does nothing unless recording was started with `start`."""
+    if _recorder is None:
+        return(NULL_SPAN)
+    return(_recorder.span(name, **info))
+
+
+def note(**info):
+    """Add figures such as `rows` to the innermost open span, if any."""
+    if _recorder is not None and _recorder.stack:
+        if threading.get_ident() == _recorder.thread:
+            _recorder.stack[-1].set(**info)
+
+
+def stage(name):
+    """Decorate a function to run as a span named `name`."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return(func(*args, **kwargs))
+            with _recorder.span(name):
+                return(func(*args, **kwargs))
+        return(wrapper)
+    return(decorate)
+
+
+def report_path(save_as):
+    """Where the run report for the output `save_as` is written."""
+    return(os.path.splitext(save_as)[0] + '.report.json')
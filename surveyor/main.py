@@ -3,12 +3,15 @@ import config
 import returns
 import gc1
 import logger
+import export
 import queue
+import threading
 from PySide import QtGui, QtCore
 
 
 class RunGC1Macro(QtCore.QObject):
     processed = QtCore.Signal(list)
+    progressed = QtCore.Signal(str, str, str, int)
 
     def __init__(self, returns, config):
         QtCore.QObject.__init__(self)
@@ -17,10 +20,46 @@ class RunGC1Macro(QtCore.QObject):
 
     @QtCore.Slot()
     def run(self):
-        df, cpt = gc1.macro(self.returns, self.config, True)
+        df, cpt = gc1.macro(self.returns, self.config, True,
+                            progress=self.report)
         self.processed_returns = df
         self.processed.emit([df])
 
+    def report(self, stage, version, question, rows):
+        self.progressed.emit(stage, '{}'.format(version or ''),
+                             '{}'.format(question or ''), rows)
+
+
+class ExportReturns(QtCore.QObject):
+    progressed = QtCore.Signal(int, object)
+    finished = QtCore.Signal(str)
+
+    def __init__(self, df, path):
+        QtCore.QObject.__init__(self)
+        self.df = df
+        self.path = path
+        self.cancelled = threading.Event()
+
+    @QtCore.Slot()
+    def run(self):
+        try:
+            rows, nbytes = export.write_csv(self.df, self.path,
+                                            progress=self.report,
+                                            cancel=self.cancelled)
+            message = 'Saved {} rows to {}'.format(rows, self.path)
+        except export.ExportCancelled:
+            message = 'Export canceled'
+        except Exception as e:
+            message = 'Export failed: {}'.format(e)
+        self.finished.emit(message)
+
+    def report(self, rows, nbytes):
+        self.progressed.emit(rows, nbytes)
+
+    def cancel(self):
+        # Called from the GUI thread while run() is busy writing
+        self.cancelled.set()
+
 
 class MainWindow(QtGui.QMainWindow):
     def __init__(self):
@@ -36,6 +75,8 @@ class MainWindow(QtGui.QMainWindow):
         self.createStatusBar()
         self.config = {}
         self.processed_returns = {}
+        self.export_thread = None
+        self.exporter = None
         self.setGeometry(500, 200, 850, 550)
         self.setWindowTitle('Read-o-matic')
         self.show()
@@ -88,8 +129,17 @@ class MainWindow(QtGui.QMainWindow):
             self.gc1_macro.moveToThread(self.gc1_thread)
             self.gc1_thread.started.connect(self.gc1_macro.run)
             self.gc1_macro.processed.connect(self.setSaveFileName)
+            self.gc1_macro.progressed.connect(self.showProgress)
             self.gc1_thread.start()
 
+    def showProgress(self, stage, version, question, rows):
+        message = 'Processing: {}'.format(stage)
+        if version:
+            message += ' version {}'.format(version)
+        if question:
+            message += ' {}'.format(question)
+        self.statusBar().showMessage('{} ({} rows)'.format(message, rows))
+
     def setSaveFileName(self, results):
         self.processed_returns = results[0]
         options = QtGui.QFileDialog.Options()
@@ -100,7 +150,43 @@ class MainWindow(QtGui.QMainWindow):
                                         "All Files (*);;Text Files (*.csv)",
                                         "", options)
         if fileName:
-            self.processed_returns.to_csv(fileName, index=False)
+            self.exportReturns(fileName)
+
+    def exportReturns(self, fileName):
+        if self.export_thread is not None:
+            QtGui.QMessageBox.warning(
+                self, "Warning", "Returns are still being saved to {}. "
+                "Wait for that to finish or cancel it first.".format(
+                    self.exporter.path))
+            return
+        self.export_thread = QtCore.QThread()
+        self.exporter = ExportReturns(self.processed_returns, fileName)
+        self.exporter.moveToThread(self.export_thread)
+        self.export_thread.started.connect(self.exporter.run)
+        self.exporter.progressed.connect(self.showExportProgress)
+        self.exporter.finished.connect(self.exportFinished)
+        self.exporter.finished.connect(self.export_thread.quit)
+        # Keep both until the thread has stopped
+        self.export_thread.finished.connect(self.exportStopped)
+        self.cancel_export.show()
+        self.export_thread.start()
+
+    def showExportProgress(self, rows, nbytes):
+        self.statusBar().showMessage(
+            'Saving: {} of {} rows ({:.1f} MB)'.format(
+                rows, len(self.exporter.df), nbytes / 1024.0 ** 2))
+
+    def cancelExport(self):
+        if self.exporter is not None:
+            self.exporter.cancel()
+
+    def exportFinished(self, message):
+        self.cancel_export.hide()
+        self.statusBar().showMessage(message)
+
+    def exportStopped(self):
+        self.export_thread = None
+        self.exporter = None
 
     def writeSettings(self):
         settings = QtCore.QSettings("Read-o-matic", "0ptimus")
@@ -137,6 +223,10 @@ class MainWindow(QtGui.QMainWindow):
         processReturns.triggered.connect(self.processReturns)
 
     def createStatusBar(self):
+        self.cancel_export = QtGui.QPushButton('Cancel Export', self)
+        self.cancel_export.clicked.connect(self.cancelExport)
+        self.cancel_export.hide()
+        self.statusBar().addPermanentWidget(self.cancel_export)
         self.statusBar().showMessage("Ready")
 
     def createDockWindows(self):
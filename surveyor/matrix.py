@@ -0,0 +1,106 @@
+import re
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# Response code for an empty answer
+MISSING = -1
+# Columns holding responses: Q1, Q2, ...
+RESPONSE_COLUMN = re.compile(r'^Q\d+$')
+
+
+def lookup_table(codes, size=16):
+    """Boolean table indexed by response code, True for each of `codes`;
+    the last slot stays False for MISSING (-1)."""
+    table = np.zeros(size, dtype=bool)
+    table[list(codes)] = True
+    return(table)
+
+
+def eat_invalid(values, rows, col, valid):
+    """Shift answers in `rows` left, in place, until `col` holds one
+    `valid` accepts or MISSING; returns the rows changed."""
+    rows = np.asarray(rows, dtype=np.intp)
+    block = values[rows, col:]
+    ok = valid[block] | (block == MISSING)
+    bad = ~ok[:, 0]
+    if not bad.any():
+        return(rows[bad])
+    rows, block, ok = rows[bad], block[bad], ok[bad]
+    n, width = block.shape
+    # Number of columns to drop: up to the first acceptable answer, or
+    # the whole row when there is none
+    ok = np.hstack([ok, np.ones((n, 1), dtype=bool)])
+    shift = ok.argmax(axis=1)
+    padded = np.hstack([block, np.full((n, width), MISSING, block.dtype)])
+    take = shift[:, np.newaxis] + np.arange(width)
+    values[rows, col:] = padded[np.arange(n)[:, np.newaxis], take]
+    return(rows)
+
+
+def push_right(values, rows, col):
+    """Shift answers in `rows` right of `col`, in place, leaving `col`
+    MISSING for a skipped question."""
+    values[rows, col + 1:] = values[rows, col:-1]
+    values[rows, col] = MISSING
+
+
+def response_columns(columns):
+    """Names of the response columns in `columns`, in question order."""
+    names = [c for c in columns if RESPONSE_COLUMN.match(c)]
+    return(sorted(names, key=lambda c: int(c[1:])))
+
+
+class ResponseMatrix(object):
+    """Response codes for a set of rows as an int8 array, one column per
+    question, shifted in place by the processing stages."""
+    def __init__(self, values, index, names):
+        self.values = values
+        self.index = index
+        self.columns = OrderedDict((n, i) for i, n in enumerate(names))
+
+    @classmethod
+    def from_frame(cls, df, names=None):
+        """Copy the response columns of `df` (all of them by default)."""
+        if names is None:
+            names = response_columns(df.columns)
+        values = np.empty((len(df), len(names)), dtype=np.int8)
+        for i, name in enumerate(names):
+            values[:, i] = df[name].values
+        return(cls(values, df.index, names))
+
+    @classmethod
+    def concat(cls, matrices):
+        """Stack matrices that share the same columns."""
+        names = list(matrices[0].columns)
+        values = np.vstack([m.values for m in matrices])
+        index = matrices[0].index.append([m.index for m in matrices[1:]])
+        return(cls(values, index, names))
+
+    def to_frame(self, names=None):
+        if names is None:
+            names = self.names
+        values = self.values[:, [self.columns[n] for n in names]]
+        return(pd.DataFrame(values, index=self.index, columns=names))
+
+    @property
+    def names(self):
+        return(list(self.columns))
+
+    def __len__(self):
+        return(len(self.values))
+
+    def column(self, name):
+        """A view of one question's responses."""
+        return(self.values[:, self.columns[name]])
+
+    def take(self, rows):
+        """A new matrix holding only `rows` (positions or a mask)."""
+        return(ResponseMatrix(self.values[rows], self.index[rows],
+                              self.names))
+
+    def eat_invalid(self, rows, name, valid):
+        return(eat_invalid(self.values, rows, self.columns[name], valid))
+
+    def push_right(self, rows, name):
+        push_right(self.values, rows, self.columns[name])
@@ -0,0 +1,142 @@
+import io
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter, defaultdict
+
+MODES = ('deterministic', 'sampling')
+# Seconds between samples of the sampling profiler
+INTERVAL = 0.005
+# Call graph paths spending less than this many seconds are left out of
+# the collapsed stacks of a deterministic profile
+MIN_PATH_TIME = 1e-5
+
+
+def frame_label(filename, line, name):
+    """How a function is named in collapsed stacks and summaries."""
+    return('{} ({}:{})'.format(name, filename.replace('\\', '/').split(
+        '/')[-1], line))
+
+
+def collapsed_stacks(stats, min_time=MIN_PATH_TIME):
+    """Collapsed stacks of a `pstats.Stats`: a Counter of
+    ``'root;...;leaf'`` to self time in microseconds."""
+    table = stats.stats
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in table.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge[3]
+    stacks = Counter()
+
+    def walk(func, path, seen, seconds):
+        _, _, tt, ct, _ = table[func]
+        # cProfile only keeps caller to callee edges, so a function's time
+        # is shared out between its callers by the time of each edge
+        share = min(seconds / ct, 1.0) if ct else 0.0
+        path = path + [frame_label(*func)]
+        stacks[';'.join(path)] += int(round(tt * share * 1e6))
+        for callee, edge_time in callees[func].items():
+            if callee in seen or edge_time * share < min_time:
+                continue
+            walk(callee, path, seen | {callee}, edge_time * share)
+
+    for func, (_, _, _, ct, callers) in table.items():
+        if not callers:
+            walk(func, [], {func}, ct)
+    return(Counter(dict((k, v) for k, v in stacks.items() if v > 0)))
+
+
+class Sampler(object):
+    """Sample the stack of one thread every `interval` seconds."""
+    def __init__(self, thread_id=None, interval=INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            path = []
+            while frame is not None:
+                code = frame.f_code
+                path.append(frame_label(code.co_filename,
+                                        code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if path:
+                self.stacks[';'.join(reversed(path))] += 1
+                self.samples += 1
+
+    def start(self):
+        self._thread.start()
+        return(self)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def write_collapsed(stacks, path):
+    with open(path, 'w') as f:
+        for stack, value in sorted(stacks.items()):
+            f.write('{} {}\n'.format(stack, value))
+    return(path)
+
+
+def self_totals(stacks):
+    """Total self value of each function (the leaf of each stack)."""
+    totals = Counter()
+    for stack, value in stacks.items():
+        totals[stack.rsplit(';', 1)[-1]] += value
+    return(totals)
+
+
+def summary(stacks, top=20, unit='samples', scale=1):
+    """The `top` functions with the most self time, as text."""
+    totals = self_totals(stacks)
+    total = sum(totals.values()) or 1
+    lines = ['{:>12} {:>6}  {}'.format(unit, '%', 'function')]
+    for label, value in totals.most_common(top):
+        lines.append('{:>12.{}f} {:>6.1%}  {}'.format(
+            value * scale, 3 if scale != 1 else 0, value / total, label))
+    return('\n'.join(lines))
+
+
+def profile(func, prefix, mode='deterministic', top=20, interval=INTERVAL):
+    """Call `func` under a cProfile or sampling profiler, saving files at
+    `prefix`; returns ``[result, paths, summary text]``."""
+    if mode not in MODES:
+        raise ValueError('Unknown profile mode: {}'.format(mode))
+    paths = []
+    if mode == 'deterministic':
+        profiler = cProfile.Profile()
+        try:
+            result = profiler.runcall(func)
+        finally:
+            paths.append(prefix + '.pstats')
+            profiler.dump_stats(paths[-1])
+            stats = pstats.Stats(profiler, stream=io.StringIO())
+            stacks = collapsed_stacks(stats)
+            paths.append(write_collapsed(stacks, prefix + '.collapsed'))
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats('cumulative').print_stats(top)
+        text = '\n'.join([summary(stacks, top, 'self seconds', 1e-6),
+                          out.getvalue().strip()])
+    else:
+        sampler = Sampler(interval=interval).start()
+        start = time.perf_counter()
+        try:
+            result = func()
+        finally:
+            sampler.stop()
+            paths.append(write_collapsed(sampler.stacks,
+                                         prefix + '.collapsed'))
+        text = '{} samples over {:.1f}s\n{}'.format(
+            sampler.samples, time.perf_counter() - start,
+            summary(sampler.stacks, top))
+    return([result, paths, text])
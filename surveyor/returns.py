@@ -1,18 +1,274 @@
 import sys
 import os
 import re
-import pandas as pd
-import numpy as np
+import functools
+import multiprocessing
+import concurrent.futures
+from collections import OrderedDict
 from PySide import QtGui, QtCore
+import gc1
+from cache import ReturnsCache
 
+# Columns of the returns list
+HEADERS = ['File', 'Date', 'Version', 'Flag1', 'Flag2', 'Rows', 'Status']
+# Editable columns holding per file metadata, by column
+METADATA_COLUMNS = {1: 'date', 2: 'version', 3: 'flag1', 4: 'flag2'}
+ROWS_COLUMN = 5
+STATUS_COLUMN = 6
+# Role the proxy model sorts by
+SORT_ROLE = QtCore.Qt.UserRole
 
-class ReturnsTreeView(QtGui.QTreeWidget):
+
+class ReturnFile(object):
+    """A return file in the list, with its metadata and load status."""
+    def __init__(self, path):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.metadata = dict((n, None) for n in METADATA_COLUMNS.values())
+        date = re.sub(r'.*(\d{2})_(\d{2})_(\d{4}).*', r'\3-\1-\2',
+                      self.filename)
+        if date:
+            self.metadata['date'] = date
+        version = re.search(r'[Vv]ersion[-_. ]?[A-Z]', self.filename)
+        if version:
+            self.metadata['version'] = re.sub(
+                r'.*[Vv]ersion[-_. ]?([A-Z]).*', r'\1', version.group())
+        self.rows = None
+        self.status = ''
+
+    def text(self, column):
+        if column == 0:
+            return(self.filename)
+        if column in METADATA_COLUMNS:
+            return(self.metadata[METADATA_COLUMNS[column]] or '')
+        if column == ROWS_COLUMN:
+            return('' if self.rows is None else '{:,}'.format(self.rows))
+        return(self.status)
+
+    def sort_key(self, column):
+        if column == ROWS_COLUMN:
+            return(-1 if self.rows is None else self.rows)
+        return(self.text(column))
+
+
+class FileRegistry(object):
+    """The listed return files, in the order they were added, indexed by
+    file name, path and version.
+
+    Lookups and the version counts are dict based and kept up to date as
+    files are added, removed or have their version changed, so nothing
+    rescans the list.
+    """
+    def __init__(self):
+        self.files = []
+        self.by_filename = {}
+        self.by_path = {}
+        # File names of each version, in order of first appearance
+        self.by_version = OrderedDict()
+        self._rows = {}
+
+    def __len__(self):
+        return(len(self.files))
+
+    def __contains__(self, filename):
+        return(filename in self.by_filename)
+
+    def get(self, filename):
+        return(self.by_filename.get(filename))
+
+    def find(self, path):
+        return(self.by_path.get(path))
+
+    def row(self, filename):
+        return(self._rows[filename])
+
+    def versions(self):
+        return(list(self.by_version))
+
+    def add(self, path):
+        """List `path`; returns its `ReturnFile`, or None if a file of the
+        same name is already listed."""
+        f = ReturnFile(path)
+        if f.filename in self.by_filename:
+            return(None)
+        self._rows[f.filename] = len(self.files)
+        self.files.append(f)
+        self.by_filename[f.filename] = f
+        self.by_path[path] = f
+        self._index_version(f, f.metadata['version'])
+        return(f)
+
+    def remove_rows(self, first, last):
+        """Remove the files in rows `first` to `last`; call `reindex` once
+        done removing."""
+        removed = self.files[first:last + 1]
+        del self.files[first:last + 1]
+        for f in removed:
+            del self.by_filename[f.filename]
+            del self.by_path[f.path]
+            del self._rows[f.filename]
+            self._unindex_version(f)
+        return(removed)
+
+    def reindex(self):
+        self._rows = dict((f.filename, i) for i, f in enumerate(self.files))
+
+    def set(self, filename, name, value):
+        f = self.by_filename[filename]
+        if name == 'version':
+            self._unindex_version(f)
+            self._index_version(f, value)
+        f.metadata[name] = value
+
+    def _index_version(self, f, version):
+        if version:
+            self.by_version.setdefault(version, set()).add(f.filename)
+
+    def _unindex_version(self, f):
+        version = f.metadata['version']
+        if version in self.by_version:
+            self.by_version[version].discard(f.filename)
+            if not self.by_version[version]:
+                del self.by_version[version]
+
+
+class ReturnsModel(QtCore.QAbstractItemModel):
+    """A flat list model of the files in a `FileRegistry`, in the order
+    they were added; views sort it through a `ReturnsSortModel`."""
+    metadataChanged = QtCore.Signal(str, str, object)
+
+    def __init__(self, registry, parent=None):
+        super(ReturnsModel, self).__init__(parent)
+        self.registry = registry
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if (parent.isValid() or not 0 <= row < len(self.registry) or
+                not 0 <= column < len(HEADERS)):
+            return(QtCore.QModelIndex())
+        return(self.createIndex(row, column))
+
+    def parent(self, index):
+        return(QtCore.QModelIndex())
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return(0 if parent.isValid() else len(self.registry))
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return(len(HEADERS))
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return(None)
+        f = self.registry.files[index.row()]
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return(f.text(index.column()))
+        if role == QtCore.Qt.ToolTipRole and index.column() == 0:
+            return(f.path)
+        if role == SORT_ROLE:
+            return(f.sort_key(index.column()))
+        return(None)
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if (not index.isValid() or role != QtCore.Qt.EditRole or
+                index.column() not in METADATA_COLUMNS):
+            return(False)
+        f = self.registry.files[index.row()]
+        name = METADATA_COLUMNS[index.column()]
+        self.registry.set(f.filename, name, '{}'.format(value) or None)
+        self.dataChanged.emit(index, index)
+        self.metadataChanged.emit(f.filename, name, f.metadata[name])
+        return(True)
+
+    def flags(self, index):
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        if index.column() in METADATA_COLUMNS:
+            flags |= QtCore.Qt.ItemIsEditable
+        return(flags)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if (orientation == QtCore.Qt.Horizontal and
+                role == QtCore.Qt.DisplayRole):
+            return(HEADERS[section])
+        return(None)
+
+    def addFiles(self, paths):
+        """List `paths` not listed yet; returns the `ReturnFile`s added.
+
+        Files are keyed by name, so only the first of several paths with
+        the same file name is listed.
+        """
+        names = set()
+        new = []
+        for path in paths:
+            if self.registry.find(path) is not None:
+                # Dropped again
+                continue
+            filename = os.path.basename(path)
+            if filename not in self.registry and filename not in names:
+                names.add(filename)
+                new.append(path)
+        if not new:
+            return([])
+        first = len(self.registry)
+        self.beginInsertRows(QtCore.QModelIndex(), first,
+                             first + len(new) - 1)
+        added = [self.registry.add(path) for path in new]
+        self.endInsertRows()
+        return(added)
+
+    def removeFiles(self, filenames):
+        """Unlist `filenames`; returns the `ReturnFile`s removed."""
+        rows = sorted(set(self.registry.row(n) for n in filenames
+                          if n in self.registry), reverse=True)
+        removed = []
+        # One removal per run of adjacent rows, from the bottom up
+        while rows:
+            last = first = rows.pop(0)
+            while rows and rows[0] == first - 1:
+                first = rows.pop(0)
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            removed.extend(self.registry.remove_rows(first, last))
+            self.endRemoveRows()
+        self.registry.reindex()
+        return(removed)
+
+    def setStatus(self, filename, status, rows=None):
+        f = self.registry.get(filename)
+        if f is None:
+            return
+        f.status = status
+        if rows is not None:
+            f.rows = rows
+        row = self.registry.row(filename)
+        self.dataChanged.emit(self.index(row, ROWS_COLUMN),
+                              self.index(row, STATUS_COLUMN))
+
+
+class ReturnsSortModel(QtGui.QSortFilterProxyModel):
+    """Keeps a `ReturnsModel` sorted as files are added and edited."""
+    def __init__(self, model, parent=None):
+        super(ReturnsSortModel, self).__init__(parent)
+        self.setSourceModel(model)
+        self.setSortRole(SORT_ROLE)
+        self.setDynamicSortFilter(True)
+
+    def filenames(self, indexes):
+        """The files in the rows of proxy `indexes`."""
+        files = self.sourceModel().registry.files
+        rows = set(self.mapToSource(i).row() for i in indexes)
+        return([files[r].filename for r in sorted(rows)])
+
+
+class ReturnsTreeView(QtGui.QTreeView):
     fileDropped = QtCore.Signal(list)
-    itemDeleted = QtCore.Signal()
+    filesDeleted = QtCore.Signal(list)
 
     def __init__(self, type, parent=None):
         super(ReturnsTreeView, self).__init__(parent)
         self.setAcceptDrops(True)
+        self.setRootIsDecorated(False)
+        self.setUniformRowHeights(True)
+        self.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
 
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls:
@@ -40,26 +296,35 @@ class ReturnsTreeView(QtGui.QTreeWidget):
 
     def keyPressEvent(self, event):
         if event.key() == QtCore.Qt.Key.Key_Delete:
-            root = self.invisibleRootItem()
-            for item in self.selectedItems():
-                (item.parent() or root).removeChild(item)
-            self.itemDeleted.emit()
+            self.filesDeleted.emit(self.model().filenames(
+                self.selectionModel().selectedRows()))
+        else:
+            super(ReturnsTreeView, self).keyPressEvent(event)
 
 
 class ReturnsDialog(QtGui.QWidget):
+    # Emitted from a pool thread when a file's load is done
+    fileLoaded = QtCore.Signal(str, object)
+
     def __init__(self, parent=None):
         super(ReturnsDialog, self).__init__(parent)
         self.load_count = 0
         self.returns = {}
+        # Listed files and their metadata; the metadata is only added to
+        # the rows when returns are combined
+        self.registry = FileRegistry()
         self.raw_returns = []
+        self.cache = ReturnsCache(version=gc1.FORMAT_VERSION)
+        # Files are parsed in worker processes as soon as they are dropped
+        self.pool = None
+        self.loading = {}
         self.createTreeWidget()
         self.createInfo()
         # SIGNALS
         self.returns_tree.fileDropped.connect(self.returnsDropped)
-        self.returns_tree.itemChanged.connect(self.printTreeContents)
-        self.returns_tree.itemDeleted.connect(self.removeReturn)
-        self.returns_tree.itemChanged.connect(self.updateInfo)
-        self.returns_tree.itemDeleted.connect(self.updateInfo)
+        self.returns_tree.filesDeleted.connect(self.removeReturn)
+        self.returns_model.metadataChanged.connect(self.metadataEdited)
+        self.fileLoaded.connect(self.finishLoad)
         self.process.triggered.connect(self.processReturns)
         # setup UI
         layout = QtGui.QGridLayout()
@@ -70,22 +335,21 @@ class ReturnsDialog(QtGui.QWidget):
         self.setMinimumWidth(400)
 
     def createTreeWidget(self):
+        self.returns_model = ReturnsModel(self.registry, self)
+        self.returns_sort = ReturnsSortModel(self.returns_model, self)
         self.returns_tree = ReturnsTreeView(self)
-        self.returns_tree.setColumnCount(5)
+        self.returns_tree.setModel(self.returns_sort)
         self.returns_tree.setSortingEnabled(True)
         self.returns_tree.setAnimated(True)
-        self.returns_tree.setHeaderLabels(['File', 'Date', 'Version', 'Flag1',
-                                           'Flag2'])
         self.returns_tree.setColumnWidth(0, 400)
-        self.returns_tree.setColumnWidth(1, 100)
-        self.returns_tree.setColumnWidth(2, 100)
-        self.returns_tree.setColumnWidth(3, 100)
-        self.returns_tree.setColumnWidth(4, 100)
+        for column in range(1, len(HEADERS)):
+            self.returns_tree.setColumnWidth(column, 100)
 
     def createInfo(self):
         self.info = QtGui.QGroupBox()
         self.return_count = QtGui.QLabel(self)
         self.version_count = QtGui.QLabel(self)
+        self.loading_count = QtGui.QLabel(self)
         self.process = QtGui.QAction(self)
         self.process.setText("Prep Returns")
         info_layout = QtGui.QVBoxLayout()
@@ -93,105 +357,158 @@ class ReturnsDialog(QtGui.QWidget):
         info_layout.addWidget(self.return_count)
         info_layout.addWidget(QtGui.QLabel("Unique versions:"))
         info_layout.addWidget(self.version_count)
+        info_layout.addWidget(QtGui.QLabel("Files loading:"))
+        info_layout.addWidget(self.loading_count)
         self.info.setLayout(info_layout)
 
     def returnsDropped(self, l):
-        for url in l:
-            if os.path.exists(url):
-                print(url)
-                item = QtGui.QTreeWidgetItem(self.returns_tree)
-                filename = os.path.basename(url)
-                item.setText(0, filename)
-                item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
-                item.setFlags(item.flags() | QtCore.Qt.ItemFlag.ItemIsEditable)
-                # Important for loading performance
-                item.setToolTip(0, url)
-                date = re.sub(r'.*(\d{2})_(\d{2})_(\d{4}).*',
-                              r'\3-\1-\2', filename)
-                if date:
-                    item.setText(1, date)
-                version = re.search(r'[Vv]ersion[-_. ]?[A-Z]', filename)
-                if version:
-                    v = re.sub(r'.*[Vv]ersion[-_. ]?([A-Z]).*',
-                               r'\1', version.group())
-                    item.setText(2, v)
-
-    def removeReturn(self):
-        tree_returns = []
-        for i in range(self.returns_tree.topLevelItemCount()):
-            item = self.returns_tree.topLevelItem(i)
-            path = '{}'.format(item.toolTip(0))
-            filename = os.path.basename(path)
-            tree_returns.append(filename)
-        delete = []
-        for r in self.returns:
-            if r not in tree_returns:
-                delete.append(r)
-        for r in delete:
-            del self.returns[r]
-            print("Deleted {}".format(r))
+        paths = [url for url in l if os.path.exists(url)]
+        for f in self.returns_model.addFiles(paths):
+            print(f.path)
+            self.startLoad(f)
+        self.updateInfo()
+
+    def startLoad(self, f):
+        """Parse a listed file in the background (see `finishLoad`)."""
+        if f.filename in self.returns or f.filename in self.loading:
+            return
+        if self.pool is None:
+            # Spawned, not forked from the running GUI
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context('spawn'))
+        future = self.pool.submit(gc1.read_return, f.path, cache=self.cache)
+        self.loading[f.filename] = future
+        self.returns_model.setStatus(f.filename, 'Loading')
+        # Runs on a pool thread; the signal brings it to the GUI thread
+        future.add_done_callback(
+            functools.partial(self.fileLoaded.emit, f.filename))
+
+    def finishLoad(self, filename, future):
+        """Keep a loaded file."""
+        if self.loading.get(filename) is not future:
+            # Removed from the list, or already finished by processReturns
+            return
+        del self.loading[filename]
+        try:
+            df = future.result()
+        except Exception as e:
+            print('Failed to load {}: {}'.format(filename, e))
+            self.returns_model.setStatus(filename, 'Failed')
+            self.updateInfo()
+            return
+        self.returns[filename] = df
+        self.load_count += 1
+        print('Load Count: {}'.format(self.load_count))
+        print('{} rows'.format(len(df)))
+        self.returns_model.setStatus(filename, 'Loaded', len(df))
+        self.updateInfo()
+
+    def removeReturn(self, filenames):
+        for f in self.returns_model.removeFiles(filenames):
+            if f.filename in self.returns:
+                del self.returns[f.filename]
+                print("Deleted {}".format(f.filename))
+            if f.filename in self.loading:
+                self.loading.pop(f.filename).cancel()
+                print("Stopped loading {}".format(f.filename))
+        self.updateInfo()
 
     def updateInfo(self):
         self.return_count.setText('<p style=font-size:20pt>{}</p>'.format(
                 len(self.returns)))
         self.version_count.setText(
-                '<p style=font-size:20pt>{}</p>'.format(len(self.versions())))
-
-    def printTreeContents(self, widget, col):
-        path = '{}'.format(widget.toolTip(0))
-        filename = os.path.basename(path)
-        # Load if it hasn't been loaded yet
-        if filename and filename not in self.returns:
-            self.returns[filename] = pd.read_table('{}'.format(path),
-                                                   dtype=np.unicode_)
-            self.load_count += 1
-            print('Load Count: {}'.format(self.load_count))
-            print('{} rows'.format(len(self.returns[filename])))
-        if filename:
-            date = widget.text(1)
-            version = widget.text(2)
-            flag1 = widget.text(3)
-            flag2 = widget.text(4)
-            if col == 1:
-                self.returns[filename]['date'] = date
-                print('date set to {}'.format(date))
-            if col == 2:
-                self.returns[filename]['version'] = version
-                print('version set to {}'.format(version))
-            if col == 3:
-                self.returns[filename]['flag1'] = flag1
-                print('"flag1" set to {}'.format(flag1))
-            if col == 4:
-                self.returns[filename]['flag2'] = flag2
-                print('"flag2" set to {}'.format(flag2))
-            print('{} columns'.format(len(self.returns[filename].columns)))
+                '<p style=font-size:20pt>{}</p>'.format(
+                    len(self.registry.by_version)))
+        self.loading_count.setText(
+                '<p style=font-size:20pt>{}</p>'.format(len(self.loading)))
+
+    def metadataEdited(self, filename, name, value):
+        print('"{}" set to {}'.format(name, value))
+        if name == 'version':
+            self.updateInfo()
 
     def versions(self):
-        unique_versions = []
-        for i in range(self.returns_tree.topLevelItemCount()):
-            v = self.returns_tree.topLevelItem(i).text(2)
-            if v and v not in unique_versions:
-                unique_versions.append(v)
-        return(unique_versions)
+        return(self.registry.versions())
+
+    def waitForLoads(self):
+        """Block until the files still loading are done."""
+        pending = list(self.loading.items())
+        concurrent.futures.wait([f for _, f in pending])
+        for filename, future in pending:
+            self.finishLoad(filename, future)
 
     def processReturns(self):
-        # Container for combined files
-        raw = pd.DataFrame()
-        for f in self.returns:
-            if not len(raw):
-                raw = self.returns[f]
-            else:
-                raw = pd.concat([raw, self.returns[f]])
-        ts = raw['date'] + ' ' + raw['Time']
-        raw['timestamp'] = pd.to_datetime(ts,
-                                          format="%Y-%m-%d %H:%M:%S %p")
+        self.loadListed()
+        self.waitForLoads()
+        failed = [f for f in self.registry.files if f.status == 'Failed']
+        if failed:
+            answer = QtGui.QMessageBox.warning(
+                self, "Warning",
+                "{} return files failed to load:\n{}\n\nRetry them, or "
+                "ignore them and leave them out?".format(
+                    len(failed), '\n'.join(f.filename for f in failed)),
+                QtGui.QMessageBox.Retry | QtGui.QMessageBox.Ignore |
+                QtGui.QMessageBox.Cancel)
+            if answer == QtGui.QMessageBox.Cancel:
+                self.raw_returns = []
+                return
+            if answer == QtGui.QMessageBox.Retry:
+                for f in failed:
+                    self.startLoad(f)
+                self.waitForLoads()
+            for f in failed:
+                if f.status == 'Failed':
+                    print('Left out {}'.format(f.filename))
+        # Only evict once no worker is reading the cache
+        self.cache.evict()
+        if not self.returns:
+            self.raw_returns = []
+            return
+        # Combine in list order, not the order the loads finished in, so
+        # the rows and which duplicate is kept do not vary between runs
+        files = [f for f in self.registry.files if f.filename in self.returns]
+        # Flags are only added when some file has them
+        names = ['date', 'version'] + [
+            n for n in ('flag1', 'flag2')
+            if any(f.metadata[n] for f in files)]
+        frames = []
+        for f in files:
+            frames.append(gc1.tag_return(
+                self.returns[f.filename],
+                **dict((n, f.metadata[n]) for n in names)))
+        raw = gc1.combine_returns(frames)
         if 'flag1' in raw:
             print("{}".format(raw['flag1'].unique()))
         if 'flag2' in raw:
             print("{}".format(raw['flag2'].unique()))
-        raw.reset_index(drop=True, inplace=True)
         self.raw_returns = raw
 
+    def loadListed(self):
+        """Start loading the listed files that are neither loaded, loading
+        nor failed."""
+        for f in self.registry.files:
+            if not f.status:
+                self.startLoad(f)
+        self.updateInfo()
+
+    def showEvent(self, event):
+        # Loads stopped when the widget was closed
+        self.loadListed()
+        super(ReturnsDialog, self).showEvent(event)
+
+    def closeEvent(self, event):
+        if self.pool is not None:
+            # Cancelling calls finishLoad at once, and running loads still
+            # report back later; it ignores them once out of `loading`
+            loading, self.loading = self.loading, {}
+            for filename, future in loading.items():
+                future.cancel()
+                self.returns_model.setStatus(filename, '')
+            self.pool.shutdown(wait=False)
+            self.pool = None
+            self.updateInfo()
+        super(ReturnsDialog, self).closeEvent(event)
+
 
 if __name__ == '__main__':
     app = QtGui.QApplication(sys.argv)
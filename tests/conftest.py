@@ -0,0 +1,31 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The surveyor modules import each other as top-level modules, and the
+# synthetic returns generator lives with the benchmarks
+sys.path.insert(0, os.path.join(ROOT, 'surveyor'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+
+def assert_same_results(got, expected):
+    """Compare two ``[sfile, cpt]`` results of the gc1 pipeline."""
+    pd.testing.assert_frame_equal(got[0].reset_index(drop=True),
+                                  expected[0].reset_index(drop=True))
+    assert list(got[1]) == list(expected[1])
+    for key, value in expected[1].items():
+        if isinstance(value, pd.Series):
+            pd.testing.assert_series_equal(got[1][key], value)
+        else:
+            np.testing.assert_allclose(got[1][key], value)
+
+
+@pytest.fixture
+def returns_dir(tmp_path):
+    import synthetic
+    path = str(tmp_path / 'returns')
+    synthetic.write_returns(path, 4000, files=4, seed=1)
+    return(path)
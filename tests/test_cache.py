@@ -0,0 +1,64 @@
+import os
+import threading
+import pandas as pd
+from cache import ReturnsCache
+
+
+def fill(cache, n):
+    df = pd.DataFrame({'a': range(100)})
+    for i in range(n):
+        cache._write(cache.entry('k{:03d}'.format(i)), df)
+
+
+def test_concurrent_evict(tmp_path):
+    path = str(tmp_path)
+    fill(ReturnsCache(path), 200)
+    caches = [ReturnsCache(path, max_bytes=0) for _ in range(2)]
+    errors = []
+    start = threading.Barrier(len(caches))
+
+    def run(cache):
+        start.wait()
+        try:
+            cache.evict()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(c,)) for c in caches]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert os.listdir(path) == []
+
+
+def test_evict_skips_vanished_entries(tmp_path, monkeypatch):
+    cache = ReturnsCache(str(tmp_path))
+    fill(cache, 3)
+    size = cache.size()
+    cache.max_bytes = size // 3
+    # Another process removes the oldest entry between listing and removal
+    entries = sorted(cache.entries(), key=lambda e: e[1])
+    monkeypatch.setattr(cache, 'entries', lambda: entries)
+    os.remove(entries[0][0])
+    assert cache.evict() == 2
+
+
+def test_version_is_part_of_the_key(tmp_path):
+    returns = tmp_path / 'returns.txt'
+    returns.write_text('a\n1\n')
+    path = str(tmp_path / 'cache')
+    parsed = []
+
+    def parser(p):
+        parsed.append(p)
+        return(pd.read_csv(p))
+
+    ReturnsCache(path, version='old').load(str(returns), parser)
+    ReturnsCache(path, version='old').load(str(returns), parser)
+    assert len(parsed) == 1
+    # A cache written by another parser layout is not read back
+    ReturnsCache(path, version='new').load(str(returns), parser)
+    assert len(parsed) == 2
+    assert len(os.listdir(path)) == 2
@@ -0,0 +1,93 @@
+import os
+import copy
+import numpy as np
+import pandas as pd
+import pytest
+import gc1
+import checkpoint
+import synthetic
+from checkpoint import Checkpoint
+from conftest import assert_same_results
+
+
+def full_run(files, config):
+    data = gc1.combine_returns(gc1.read_returns(files, 1))
+    return(gc1.macro(data, config))
+
+
+@pytest.fixture
+def config():
+    return(synthetic.load_plan().config)
+
+
+def relabeled(config):
+    config = copy.deepcopy(config)
+    for q in config['questions']:
+        if q['name'] != 'remove':
+            q['name'] = q['name'] + '_x'
+        q['responses'] = dict((nm.upper(), i)
+                              for nm, i in q['responses'].items())
+    return(config)
+
+
+def restructured(config):
+    config = copy.deepcopy(config)
+    del config['questions'][-1]
+    return(config)
+
+
+def test_unreadable_entry_is_a_miss(tmp_path):
+    ck = Checkpoint(str(tmp_path))
+    ck.write('k', 's', 'c', ['Q1'], np.zeros((3, 1), dtype=np.int8),
+             pd.DataFrame({'a': [1, 2, 3]}))
+    entry = ck.entry('k')
+    with open(entry, 'rb') as f:
+        data = f.read()
+    with open(entry, 'wb') as f:
+        f.write(data[:len(data) // 2])
+    assert ck.read('k') is None
+    assert not os.path.exists(entry)
+    assert ck.read('missing') is None
+
+
+def test_new_files_match_full_run(returns_dir, tmp_path, config):
+    files = gc1.find_returns(returns_dir)
+    path = str(tmp_path / 'checkpoint')
+    assert_same_results(checkpoint.process(files[:2], config, path),
+                        full_run(files[:2], config))
+    assert_same_results(checkpoint.process(files, config, path),
+                        full_run(files, config))
+    # Nothing new
+    assert_same_results(checkpoint.process(files, config, path),
+                        full_run(files, config))
+
+
+def test_relabel_matches_full_run(returns_dir, tmp_path, config,
+                                  monkeypatch):
+    files = gc1.find_returns(returns_dir)
+    path = str(tmp_path / 'checkpoint')
+    checkpoint.process(files, config, path)
+    new = relabeled(config)
+    expected = full_run(files, new)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('responses were processed again')
+    monkeypatch.setattr(gc1, 'process_versions', fail)
+    assert_same_results(checkpoint.process(files, new, path), expected)
+
+
+def test_interrupted_run_does_not_leak_entries(returns_dir, tmp_path,
+                                               config, monkeypatch):
+    files = gc1.find_returns(returns_dir)
+    path = str(tmp_path / 'checkpoint')
+    checkpoint.process(files, config, path)
+
+    # A run with another structure dies after writing its entries
+    def crash(*args, **kwargs):
+        raise KeyboardInterrupt()
+    with monkeypatch.context() as m:
+        m.setattr(Checkpoint, 'save', crash)
+        with pytest.raises(KeyboardInterrupt):
+            checkpoint.process(files, restructured(config), path)
+    assert_same_results(checkpoint.process(files, config, path),
+                        full_run(files, config))
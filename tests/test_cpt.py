@@ -0,0 +1,10 @@
+import gc1
+from bench_cpt import check_same, cpt_former
+from common import IDS, make_calls
+
+
+def test_cpt_matches_baseline():
+    trans, labeled, valid_qs = make_calls(6000, seed=3)
+    expected = cpt_former(trans.copy(), labeled.copy(), IDS, valid_qs)
+    check_same(expected, gc1.call_performance_information(
+        trans.copy(), labeled.copy(), IDS, valid_qs))
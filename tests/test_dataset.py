@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+import dataset
+import gc1
+
+
+def test_read_partition_columns_only(tmp_path):
+    pytest.importorskip('pyarrow')
+    df = pd.DataFrame({'version': ['A', 'A', 'B'],
+                       'date': ['2020-01-01', '2020-01-02', '2020-01-01'],
+                       'x': [1, 2, 3]})
+    cpt = {'respondents': 3, 'rate': pd.Series([0.5], index=['Q1'])}
+    path = dataset.write_dataset(str(tmp_path / 'ds'), df, df, cpt)
+    got = dataset.read_dataset(path, columns=['version', 'date'])
+    expected = df[['version', 'date']]
+    pd.testing.assert_frame_equal(
+        got.sort_values(['version', 'date']).reset_index(drop=True),
+        expected, check_dtype=False)
+
+
+def test_missing_pyarrow_fails_before_processing(monkeypatch):
+    monkeypatch.setattr(dataset, 'pyarrow', None)
+    with pytest.raises(ImportError):
+        gc1.check_options({'dataset': 'out'})
+    with pytest.raises(ValueError):
+        gc1.check_options({'dataset': 'out', 'dataset_format': 'csv'})
+    gc1.check_options({})
+
+
+def test_response_codes_read_back_as_keys(tmp_path):
+    pytest.importorskip('pyarrow')
+    keys = pd.Series(['1', '#', None, 'x', '*'])
+    df = pd.DataFrame({'version': ['A'] * 5, 'Q1': gc1.encode_responses(keys)})
+    cpt = {'respondents': 5}
+    path = dataset.write_dataset(str(tmp_path / 'ds'), df, df, cpt,
+                                 keys=gc1.PHONE_KEYS)
+    assert dataset.read_metadata(path)['responses']['keys'] == list(
+        gc1.PHONE_KEYS)
+    got = dataset.read_dataset(path, columns=['Q1'], decode_responses=True)
+    assert got['Q1'].tolist() == ['1', '#', None, '?', '*']
+    got = dataset.read_dataset(path, columns=['Q1'])
+    assert got['Q1'].tolist() == df['Q1'].tolist()
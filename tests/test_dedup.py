@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import gc1
+from common import make_trans
+
+
+def expected_report(trans, source='source'):
+    """The duplicates report of `drop_duplicate_calls`, by pandas."""
+    columns = [c for c in trans.columns if c != source]
+    dup = trans.duplicated(columns)
+    files = trans[source].astype(str)
+    first = files.groupby([trans[c] for c in columns], sort=False,
+                          dropna=False).transform('first')
+    overlap = dup & (files != first)
+    return(trans.drop_duplicates(columns), int(dup.sum()),
+           int(overlap.sum()), files[overlap].value_counts())
+
+
+def test_report_matches_drop_duplicates():
+    trans = make_trans(2000, seed=3, duplicated=0.2)
+    got, report = gc1.drop_duplicate_calls(trans)
+    kept, duplicates, overlapping, files = expected_report(trans)
+    pd.testing.assert_frame_equal(got, kept)
+    assert report['rows'] == len(trans)
+    assert report['duplicates'] == duplicates
+    assert 0 < report['overlapping'] == overlapping < duplicates
+    pd.testing.assert_series_equal(report['files'].sort_index(),
+                                   files.sort_index(), check_names=False)
+
+
+def test_fingerprint_collisions_fall_back_to_exact(monkeypatch):
+    trans = make_trans(500, seed=4, duplicated=0.1)
+    # Every row hashes alike, so only the exact check tells them apart
+    monkeypatch.setattr(gc1, 'row_fingerprints',
+                        lambda df, columns=None: np.zeros(len(df), np.uint64))
+    got, report = gc1.drop_duplicate_calls(trans, check=True)
+    kept, duplicates, overlapping, _ = expected_report(trans)
+    pd.testing.assert_frame_equal(got, kept)
+    assert report['duplicates'] == duplicates
+    assert report['overlapping'] == overlapping
+    # Unchecked, the colliding rows are all taken for one call
+    got, _ = gc1.drop_duplicate_calls(trans)
+    assert len(got) == 1
@@ -0,0 +1,54 @@
+import os
+import threading
+import pandas as pd
+import pytest
+import export
+
+
+@pytest.fixture
+def df():
+    return(pd.DataFrame({'a': range(1000), 'b': ['x'] * 1000}))
+
+
+def test_write_csv(tmp_path, df):
+    path = str(tmp_path / 'out.csv')
+    rows, nbytes = export.write_csv(df, path, chunk_rows=100)
+    assert rows == len(df)
+    assert nbytes == os.path.getsize(path)
+    pd.testing.assert_frame_equal(pd.read_csv(path), df)
+    assert os.listdir(str(tmp_path)) == ['out.csv']
+
+
+def test_cancelled_export_leaves_no_files(tmp_path, df):
+    path = str(tmp_path / 'out.csv')
+    cancel = threading.Event()
+
+    def progress(rows, nbytes):
+        if rows >= 300:
+            cancel.set()
+    with pytest.raises(export.ExportCancelled):
+        export.write_csv(df, path, 100, progress, cancel)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_failed_export_leaves_no_files(tmp_path, df):
+    path = str(tmp_path / 'out.csv')
+
+    def progress(rows, nbytes):
+        raise OSError('disk full')
+    with pytest.raises(OSError):
+        export.write_csv(df, path, 100, progress)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_failed_export_keeps_previous_file(tmp_path):
+    path = str(tmp_path / 'out.csv')
+    with open(path, 'w') as f:
+        f.write('old')
+    # Not a frame, so writing it fails
+    job = export.ExportJob(None, path, 100).start()
+    with pytest.raises(TypeError):
+        job.wait()
+    with open(path) as f:
+        assert f.read() == 'old'
+    assert os.listdir(str(tmp_path)) == ['out.csv']
@@ -0,0 +1,78 @@
+import os
+import pandas as pd
+import pytest
+import gc1
+
+COLUMNS = {
+    'Account Number 1': ['1', '2', '3'],
+    'Account Number 2': ['a', 'b', 'c'],
+    'Charge': ['.1', '.2', '.05'],
+    'Contact Result': ['answered', 'busy', 'answered'],
+    'First Name': ['F', 'F', 'F'],
+    'Last Name': ['L', 'L', 'L'],
+    'Other 1': ['', '', ''],
+    'Other 2': ['', '', ''],
+    'Phone #': ['5551', '5552', '5553'],
+    'Seconds': ['3', '4', '60'],
+    'Time': ['10:00:00 AM', '11:30:00 AM', '09:15:00 PM'],
+}
+
+
+def write_return(path, name, **columns):
+    df = pd.DataFrame(dict(COLUMNS, **columns))
+    df.to_csv(os.path.join(path, name), sep='\t', index=False)
+
+
+@pytest.fixture
+def mixed_returns(tmp_path):
+    """Return files with different response columns and one without a
+    version in its name."""
+    path = str(tmp_path)
+    write_return(path, 'Camp version-A Day1_10_10_2015.txt',
+                 Q1=['1', '2', '#'], Q2=['2', '1', None])
+    write_return(path, 'Camp Day2_10_11_2015.txt', Q1=['1', None, '*'])
+    write_return(path, 'Camp version-B Day3_10_12_2015.txt',
+                 Q1=['3', '1', '2'], Q2=['1', '1', '1'], Q3=['9', '', '2'],
+                 **{'Other 3': ['x', 'y', 'z']})
+    return(path)
+
+
+def test_missing_response_columns_stay_missing(mixed_returns):
+    data = gc1.load_returns(mixed_returns, 1)
+    assert [data[q].dtype.name for q in ('Q1', 'Q2', 'Q3')] == ['int8'] * 3
+    keys = gc1.decode_responses(data[['Q1', 'Q2', 'Q3']].values).tolist()
+    # Files are combined in name order
+    assert keys == [['1', None, None], [None, None, None], ['*', None, None],
+                    ['1', '2', None], ['2', '1', None], ['#', None, None],
+                    ['3', '1', '9'], ['1', '1', None], ['2', '1', '2']]
+
+
+def baseline_frame(path):
+    """The returns as the former loader read them: all strings."""
+    frames = []
+    for f, version, date in gc1.find_returns(path):
+        df = pd.read_table(f, dtype=str)
+        df['version'] = version
+        df['date'] = date
+        frames.append(df)
+    return(pd.concat(frames, ignore_index=True))
+
+
+def test_pool_and_serial_loads_match_baseline(mixed_returns):
+    serial = gc1.load_returns(mixed_returns, 1)
+    pooled = gc1.load_returns(mixed_returns, 2)
+    pd.testing.assert_frame_equal(serial, pooled)
+    expected = baseline_frame(mixed_returns)
+    assert set(expected.columns) <= set(serial.columns)
+    for col in expected.columns:
+        if col.startswith('Q'):
+            got = gc1.decode_responses(serial[col].values)
+        elif col in ('Charge', 'Seconds'):
+            pd.testing.assert_series_equal(
+                serial[col], expected[col].astype(float))
+            continue
+        else:
+            got = serial[col].astype(object).values
+        want = expected[col].values
+        assert [None if pd.isnull(v) else v for v in got] == \
+            [None if pd.isnull(v) else v for v in want], col
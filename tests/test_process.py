@@ -0,0 +1,118 @@
+import re
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pytest
+import gc1
+from matrix import MISSING, ResponseMatrix, eat_invalid, push_right
+
+QUESTIONS = 20
+# Versioned and onlyif questions, '#' and '*' answers and a gap in order
+CONFIG = {
+    'options': {'id1': 'id1'},
+    'questions': [
+        {'name': 'verified', 'order': 1,
+         'responses': {'yes': 1, 'no': 2, 'maybe': 3}},
+        {'name': 'party', 'order': 2, 'onlyif': {'question': 1, 'equals': 1},
+         'responses': {'dem': 1, 'gop': 2, 'other': '#'}},
+        {'name': 'party_b', 'order': 2, 'version': 'B',
+         'onlyif': {'question': 1, 'equals': 3},
+         'responses': {'dem': 1, 'gop': 2}},
+        {'name': 'age', 'order': 3,
+         'responses': {'young': 1, 'mid': 2, 'old': 3, 'ref': '*'}},
+        {'name': 'zip', 'order': 4, 'onlyif': {'question': 3, 'equals': 12},
+         'responses': {'in': 1, 'out': 2}},
+        {'name': 'remove', 'order': 5, 'responses': {'remove': 9}},
+        {'name': 'vote', 'order': 7, 'version': 'A',
+         'responses': {'y': 1, 'n': 2}},
+    ],
+}
+
+
+def reference_process(rows, questions):
+    """The baseline process_version, one row of keys at a time.
+
+    Follows the former pandas implementation: invalid answers are eaten
+    one column at a time, and rows no question applied to are pushed
+    right one column at a time.
+    """
+    labels = OrderedDict((q['name'], [None] * len(rows)) for q in questions)
+    for j in sorted(set(q['order'] for q in questions)):
+        matches = [q for q in questions if q['order'] == j]
+        for r, row in enumerate(rows):
+            mv = False
+            for m in matches:
+                if m['onlyif']:
+                    key = row[int(m['onlyif']['question']) - 1]
+                    regex = r'^[' + str(m['onlyif']['equals']) + ']$'
+                    if key is None or not re.match(regex, key):
+                        continue
+                mv = True
+                invalid = r'[^' + ''.join(
+                    str(i) for i in m['responses'].values()) + ']'
+                while (row[j - 1] is not None and
+                       re.search(invalid, row[j - 1])):
+                    row[j - 1:] = row[j:] + [None]
+                for nm, i in m['responses'].items():
+                    if row[j - 1] == str(i):
+                        labels[m['name']][r] = nm
+            if row[j - 1] is None:
+                mv = True
+            if j != 1 and not mv:
+                row[j - 1:] = [None] + row[j - 1:-1]
+    return(rows, labels)
+
+
+def random_keys(n, seed):
+    rng = np.random.RandomState(seed)
+    keys = np.array(gc1.PHONE_KEYS + ('?',), dtype=object)
+    rows = keys[rng.randint(0, len(keys), size=(n, QUESTIONS))]
+    # Calls hang up part way
+    lengths = rng.randint(0, QUESTIONS + 1, n)
+    rows[np.arange(QUESTIONS) >= lengths[:, np.newaxis]] = None
+    return(rows)
+
+
+@pytest.mark.parametrize('version', ['A', 'B'])
+def test_process_version_matches_baseline(version):
+    plan = gc1.compile_config(gc1.ValidConfig().to_python(CONFIG))
+    keys = random_keys(3000, seed=ord(version))
+    qs = ['Q' + str(i + 1) for i in range(QUESTIONS)]
+    frame = pd.DataFrame(keys, columns=qs)
+    for q in qs:
+        frame[q] = gc1.encode_responses(frame[q])
+    v_data, l_data = gc1.process_version(
+        ResponseMatrix.from_frame(frame, qs), plan.for_version(version),
+        OrderedDict(), False, qs)
+    questions = [q.question for q in plan.for_version(version)]
+    rows, labels = reference_process([list(r) for r in keys], questions)
+    assert gc1.decode_responses(v_data.values).tolist() == rows
+    assert list(l_data) == list(labels)
+    for name, expected in labels.items():
+        got = [None if pd.isnull(v) else v for v in l_data[name]]
+        assert got == expected, name
+
+
+def test_eat_invalid_matches_one_column_at_a_time():
+    rng = np.random.RandomState(0)
+    values = rng.randint(MISSING, 12, size=(500, 8)).astype(np.int8)
+    valid = np.zeros(16, dtype=bool)
+    valid[[1, 2, 10]] = True
+    expected = values.copy()
+    for row in expected:
+        while row[2] != MISSING and not valid[row[2]]:
+            row[2:] = np.append(row[3:], MISSING)
+    eat_invalid(values, np.arange(len(values)), 2, valid)
+    assert (values == expected).all()
+
+
+def test_push_right_matches_one_column_at_a_time():
+    rng = np.random.RandomState(0)
+    values = rng.randint(MISSING, 12, size=(500, 8)).astype(np.int8)
+    mask = rng.rand(len(values)) < .5
+    expected = values.copy()
+    for k in range(7, 2, -1):
+        expected[mask, k] = expected[mask, k - 1]
+    expected[mask, 2] = MISSING
+    push_right(values, mask, 2)
+    assert (values == expected).all()